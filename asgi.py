@@ -0,0 +1,5 @@
+from asgiref.wsgi import WsgiToAsgi
+from umbrella import app
+
+# for ASGI servers, e.g. `uvicorn asgi:application`; requests still run in worker threads
+application = WsgiToAsgi(app)
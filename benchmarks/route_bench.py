@@ -0,0 +1,256 @@
+"""Measure latency, throughput and SQL round trips of the main routes.
+
+The app runs in process through Flask's test client, against the database
+configured by the usual UMBRELLA_* variables. Before each size is measured
+the post table is topped up to that many posts with `flask umbrella bulk-load`'s
+synthetic generator, so point it at a staging database, never production.
+Run `flask umbrella sync-schema` first, then from the repository root:
+
+    python -m benchmarks.route_bench --sizes 1000 10000 100000
+
+Every request's round trips are counted; the run fails when a route goes over
+its budget in benchmarks/budgets.json. Results are written as JSON, and
+--compare prints the change against an earlier results file.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from umbrella import app
+import umbrella.bulk_load as bulk_load
+import umbrella.db_interface as db_interface
+from umbrella.password_hasher import password_hasher
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), 'budgets.json')
+
+_counter = threading.local()
+
+
+def count_query(statement, seconds, rows):
+    _counter.queries = getattr(_counter, 'queries', 0) + 1
+
+
+class Dataset():
+    def __init__(self, size, seed):
+        self.size = size
+        self.rng = random.Random(seed)
+
+        self.post_ids = self.id_range('post')
+        self.profile_ids = self.id_range('profile')
+        self.category_titles = [row[0] for row in db_interface.run_query(
+            "SELECT title FROM category WHERE is_deleted = False ORDER BY id")]
+
+    def id_range(self, table_name):
+        low, high = db_interface.run_query(f"SELECT min(id), max(id) FROM {table_name}")[0]
+        return range(low, high + 1)
+
+    def post_id(self):
+        return self.rng.choice(self.post_ids)
+
+    def profile_id(self):
+        return self.rng.choice(self.profile_ids)
+
+    def term(self):
+        return ' '.join(self.rng.sample(bulk_load.WORDS, self.rng.randint(1, 2)))
+
+    def login_data(self, profile_id):
+        # the synthetic users' credentials, see bulk_load.synthetic_rows
+        return {'email': f"user{profile_id}@example.com", 'password': f"password{profile_id}"}
+
+
+def log_in(client, dataset):
+    response = client.post('/login', data=dataset.login_data(dataset.profile_id()))
+    if response.status_code != 302:
+        raise RuntimeError(f"Could not log in a synthetic user ({response.status_code}).")
+
+
+# name -> (needs a logged in client, request); each request returns a test client response
+ROUTES = {
+    'home': (False, lambda c, d: c.get('/home')),
+    'post': (False, lambda c, d: c.get(f'/post/{d.post_id()}')),
+    'search': (False, lambda c, d: c.get('/search-results', query_string={'query': d.term()})),
+    'profile': (False, lambda c, d: c.get(f'/profile/{d.profile_id()}')),
+    # a logged in client would be redirected straight away
+    'login': (False, lambda c, d: app.test_client().post('/login', data=d.login_data(d.profile_id()))),
+    'create_post': (True, lambda c, d: c.post('/create-post', data={
+        'title': f"bench {uuid.uuid4().hex[:12]}",
+        'content': '<p>' + d.term() + '</p>',
+        'category': d.rng.choice(d.category_titles),
+    })),
+    'comment': (True, lambda c, d: c.post(f'/post/{d.post_id()}', data={'content': d.term()})),
+    'view': (False, lambda c, d: c.get(f'/post/{d.post_id()}/view')),
+}
+
+
+def percentile(timings, p):
+    return timings[min(len(timings) - 1, int(len(timings) * p / 100))]
+
+
+def run_client(route, dataset, count, warmup):
+    needs_login, send = ROUTES[route]
+    client = app.test_client()
+    if needs_login:
+        log_in(client, dataset)
+
+    samples = []
+    measured_from = None
+    for n in range(warmup + count):
+        _counter.queries = 0
+        start = time.perf_counter()
+        if n == warmup:
+            measured_from = start
+        response = send(client, dataset)
+        elapsed = time.perf_counter() - start
+
+        if n >= warmup:
+            samples.append((elapsed * 1000, _counter.queries, response.status_code))
+
+    return samples, measured_from, time.perf_counter()
+
+
+def bench_route(route, dataset, requests, warmup, concurrency):
+    per_client = max(1, requests // concurrency)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_client, route, dataset, per_client, warmup) for _ in range(concurrency)]
+        results = [future.result() for future in futures]
+
+    samples = [sample for client_samples, _, _ in results for sample in client_samples]
+    # from the first measured request to the last, leaving out the warmup
+    elapsed = max(r[2] for r in results) - min(r[1] for r in results)
+
+    timings = sorted(sample[0] for sample in samples)
+    queries = [sample[1] for sample in samples]
+
+    return {
+        'requests': len(samples),
+        'throughput_rps': len(samples) / elapsed,
+        'mean_ms': statistics.mean(timings),
+        'p50_ms': percentile(timings, 50),
+        'p90_ms': percentile(timings, 90),
+        'p99_ms': percentile(timings, 99),
+        'max_ms': timings[-1],
+        'queries_mean': statistics.mean(queries),
+        'queries_max': max(queries),
+        'errors': sum(1 for sample in samples if sample[2] >= 400),
+    }
+
+
+def seed(size, seed, comments_per_post):
+    # tops the dataset up, so sizes are best given in increasing order
+    missing = size - db_interface.run_query("SELECT count(*) FROM post")[0][0]
+    if missing <= 0:
+        return
+
+    has_categories = db_interface.run_query("SELECT count(*) FROM category")[0][0] > 0
+    sizes = {
+        'profile': max(10, missing // 100),
+        'category': 0 if has_categories else 20,
+        'post': missing,
+        'comment': missing * comments_per_post,
+    }
+    bulk_load.load_synthetic(sizes, seed=seed + size, echo=lambda line: print(f"  seeded {line}"))
+
+
+def check_budgets(report, budgets):
+    failures = []
+    for size, routes in report.items():
+        for route, result in routes.items():
+            budget = budgets.get(route)
+            if budget is not None and result['queries_max'] > budget:
+                failures.append(f"{size} posts: {route} made {result['queries_max']} round trips, budget {budget}")
+    return failures
+
+
+def compare(report, path):
+    with open(path) as f:
+        previous = json.load(f)['sizes']
+
+    for size, routes in report.items():
+        for route, result in routes.items():
+            before = previous.get(size, {}).get(route)
+            if before:
+                change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+                print(f"  {size:>9} {route:12} p50 {before['p50_ms']:8.2f} -> {result['p50_ms']:8.2f} ms"
+                      f" ({change:+.1f}%)  queries {before['queries_max']} -> {result['queries_max']}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per client')
+    parser.add_argument('--concurrency', type=int, default=1, help='clients sending requests at once')
+    parser.add_argument('--comments-per-post', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--budgets', default=BUDGETS_PATH, help='JSON file of route -> max round trips')
+    parser.add_argument('--output', help='results file (default: route_bench-<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    # the benchmark posts forms without rendering them first
+    app.config['WTF_CSRF_ENABLED'] = False
+    # otherwise every synthetic user's first login rehashes its password at the configured cost
+    password_hasher.rounds = bulk_load.SYNTHETIC_ROUNDS
+    db_interface.add_query_listener(count_query)
+
+    with open(args.budgets) as f:
+        budgets = json.load(f)
+
+    report = {}
+    for size in sorted(args.sizes):
+        print(f"{size} posts")
+        seed(size, args.seed, args.comments_per_post)
+        dataset = Dataset(size, args.seed)
+
+        report[str(size)] = {}
+        for route in args.routes:
+            r = bench_route(route, dataset, args.requests, args.warmup, args.concurrency)
+            report[str(size)][route] = r
+            print(f"  {route:12} p50 {r['p50_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms"
+                  f"  {r['throughput_rps']:8.1f} req/s  queries {r['queries_max']}"
+                  + (f"  errors {r['errors']}" if r['errors'] else ""))
+
+    finished = datetime.datetime.now()
+    output = args.output or f"route_bench-{finished:%Y%m%d-%H%M%S}.json"
+    with open(output, 'w') as f:
+        json.dump({
+            'finished_at': finished.isoformat(),
+            'revision': git_revision(),
+            'config': vars(args),
+            'budgets': budgets,
+            'sizes': report,
+        }, f, indent=2)
+    print(f"wrote {output}")
+
+    if args.compare:
+        print(f"compared with {args.compare}")
+        compare(report, args.compare)
+
+    failures = check_budgets(report, budgets)
+    for failure in failures:
+        print(f"over budget: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
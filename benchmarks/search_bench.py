@@ -0,0 +1,118 @@
+"""Compare the full-text post search against the old title LIKE scan.
+
+Each size gets its own scratch copy of the post table, filled with
+deterministic synthetic rows, so the real data is never touched. Run
+`flask umbrella sync-schema` first, then from the repository root:
+
+    python -m benchmarks.search_bench --sizes 100000 1000000
+"""
+import argparse
+import json
+import statistics
+import time
+
+import umbrella.db_interface as db_interface
+
+WORDS = [
+    'umbrella', 'rain', 'storm', 'forecast', 'cloud', 'thunder', 'drizzle', 'monsoon',
+    'weather', 'climate', 'python', 'flask', 'postgres', 'index', 'cache', 'search',
+    'garden', 'travel', 'recipe', 'bread', 'coffee', 'mountain', 'river', 'ocean',
+    'history', 'science', 'music', 'guitar', 'painting', 'camera', 'bicycle', 'running',
+]
+
+TERMS = ['storm', 'postgres index', 'coff', 'mountain river', 'nonexistentword']
+
+
+def word_expr(seed):
+    words = "ARRAY[" + ", ".join(f"'{w}'" for w in WORDS) + "]"
+    return f"({words})[1 + (i * {seed}) % {len(WORDS)}]"
+
+
+def seed_table(cursor, table_name, size):
+    cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+    cursor.execute(f"CREATE TABLE {table_name} (LIKE post INCLUDING DEFAULTS INCLUDING GENERATED);")
+
+    title = f"{word_expr(7)} || ' ' || {word_expr(13)} || ' ' || i"
+    content = " || ' ' || ".join(word_expr(p) for p in (3, 11, 17, 19, 23, 29, 31, 37))
+
+    cursor.execute(
+        f"""
+        INSERT INTO {table_name} (id, title, "content", created_at, view_count, author_id, category_id, is_deleted)
+        SELECT i, {title}, repeat({content} || ' ', 20), now() - i * interval '1 minute', 0, 1, 1, False
+        FROM generate_series(1, %s) AS i;
+        """,
+        [size],
+    )
+    cursor.execute(f"CREATE INDEX ON {table_name} USING GIN (search_vector);")
+    cursor.execute(f"ANALYZE {table_name};")
+
+
+def time_query(cursor, query, params, repeat):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        rows = len(cursor.fetchall())
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        'rows': rows,
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[max(0, int(len(timings) * 0.95) - 1)],
+    }
+
+
+def bench_size(conn, size, repeat, limit, keep):
+    table_name = f"bench_post_{size}"
+    cursor = conn.cursor()
+    seed_table(cursor, table_name, size)
+    conn.commit()
+
+    like_q = f"SELECT * FROM {table_name} WHERE title LIKE %s AND is_deleted = False LIMIT {limit}"
+    fts_q = f"SELECT t.* FROM {table_name} t, to_tsquery('english', %s) q " \
+            f"WHERE t.search_vector @@ q AND t.is_deleted = False " \
+            f"ORDER BY ts_rank_cd(t.search_vector, q) DESC, t.id DESC LIMIT {limit}"
+
+    results = {}
+    for term in TERMS:
+        results[term] = {
+            'like': time_query(cursor, like_q, [f'%{term}%'], repeat),
+            'fts': time_query(cursor, fts_q, [db_interface.to_prefix_tsquery(term)], repeat),
+        }
+
+    if not keep:
+        cursor.execute(f"DROP TABLE {table_name};")
+    conn.commit()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch tables')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    conn = db_interface.open_conn()
+    try:
+        report = {str(size): bench_size(conn, size, args.repeat, args.limit, args.keep) for size in args.sizes}
+    finally:
+        conn.close()
+
+    for size, terms in report.items():
+        print(f"{size} posts")
+        for term, r in terms.items():
+            print(f"  {term!r:20} like {r['like']['median_ms']:9.2f} ms ({r['like']['rows']} rows)"
+                  f"   fts {r['fts']['median_ms']:9.2f} ms ({r['fts']['rows']} rows)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
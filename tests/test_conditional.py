@@ -0,0 +1,27 @@
+import umbrella.db_interface as db_interface
+from umbrella import app
+from umbrella.conditional import conditional
+
+
+class FakeReplicas():
+    def choose(self):
+        return 'replica pool'
+
+
+def test_view_rendered_under_a_fresh_etag_reads_the_primary(monkeypatch):
+    monkeypatch.setattr(db_interface, 'get_replicas', FakeReplicas)
+    read_pools = []
+
+    @conditional('home', lambda: (['v1'], None))
+    def view():
+        read_pools.append(db_interface.get_read_pool())
+        return 'page'
+
+    try:
+        with app.test_request_context('/'):
+            assert view().status_code == 200
+    finally:
+        db_interface.pin_to_primary(False)
+
+    # None is the primary, where the version was read
+    assert read_pools == [None]
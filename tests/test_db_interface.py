@@ -0,0 +1,74 @@
+import psycopg2
+
+import umbrella.db_interface as db_interface
+from umbrella.db_pool import ConnectionPool
+
+
+class FakeCursor():
+    def __init__(self, conn, name=None):
+        self.conn = conn
+        self.name = name
+        self.description = None
+        self.rowcount = -1
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.conn.queries.append(query)
+        self.description = [('n',)]
+        self._rows = [(n,) for n in range(5)] if self.name else [(42,)]
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConn():
+    def __init__(self):
+        self.closed = 0
+        self.queries = []
+        self.status = psycopg2.extensions.STATUS_READY
+
+    def cursor(self, name=None):
+        return FakeCursor(self, name)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def test_queries_inside_a_stream_share_its_connection(monkeypatch):
+    # with one connection in the pool, a second checkout would time out
+    pool = ConnectionPool(FakeConn, max_size=1, timeout=0.01)
+    monkeypatch.setattr(db_interface, 'get_pool', lambda: pool)
+
+    looked_up = []
+    for rows in db_interface.stream_query("SELECT n FROM numbers", batch_size=2):
+        looked_up.append(db_interface.run_query("SELECT 42")[0][0])
+
+    assert looked_up == [42, 42, 42]
+    assert db_interface.current_transaction() is None
+    assert pool.stats()['checkouts'] == 1
+
+
+def test_abandoned_stream_is_no_longer_the_transaction(monkeypatch):
+    pool = ConnectionPool(FakeConn, max_size=1, timeout=0.01)
+    monkeypatch.setattr(db_interface, 'get_pool', lambda: pool)
+
+    stream = db_interface.stream_query("SELECT n FROM numbers", batch_size=2)
+    next(stream)
+    stream.close()
+
+    assert db_interface.current_transaction() is None
+    assert pool.stats()['in_use'] == 0
@@ -0,0 +1,67 @@
+import psycopg2
+import pytest
+
+from umbrella.db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor():
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.dead:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def close(self):
+        pass
+
+
+class FakeConn():
+    def __init__(self):
+        self.closed = 0
+        self.dead = False
+        self.status = psycopg2.extensions.STATUS_READY
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def test_error_on_live_connection_does_not_grow_pool():
+    pool = ConnectionPool(FakeConn, max_size=1, timeout=0.01)
+
+    # a statement timeout: the connection is dropped although it is still open
+    with pytest.raises(psycopg2.extensions.QueryCanceledError):
+        with pool.connection():
+            raise psycopg2.extensions.QueryCanceledError()
+
+    stats = pool.stats()
+    assert (stats['size'], stats['in_use'], stats['idle']) == (0, 0, 0)
+
+    conn = pool.getconn()
+    assert not conn.closed
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    pool.putconn(conn)
+
+
+def test_broken_connection_makes_idle_ones_checked():
+    pool = ConnectionPool(FakeConn, max_size=2)
+    first, second = pool.getconn(), pool.getconn()
+    pool.putconn(first)
+
+    # the server restarts: both connections are dead, only second has noticed
+    first.dead = second.dead = True
+    second.closed = 2
+    pool.putconn(second, broken=True)
+
+    # first is young, but older than the failure, so it is pinged before reuse
+    assert pool.stats()['size'] == 1
+    conn = pool.getconn()
+    assert conn is not first and first.closed
+    assert pool.stats()['reconnects'] == 1
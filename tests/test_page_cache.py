@@ -0,0 +1,52 @@
+import os
+import time
+
+from flask import g
+
+from umbrella import app
+from umbrella.page_cache import FileBackend, MemoryBackend, request_key
+
+
+def count_files(directory):
+    return sum(len(names) for _, _, names in os.walk(directory))
+
+
+def test_file_backend_keeps_at_most_max_files(tmp_path):
+    backend = FileBackend(str(tmp_path), ttl=30.0, max_files=20)
+
+    # one file per distinct query string
+    for n in range(100):
+        backend.set('post:1', f'/post/1?x={n}', 'page', backend.token('post:1'))
+
+    assert count_files(tmp_path) <= 20
+    assert backend.get('post:1', '/post/1?x=99') == 'page'
+
+
+def test_file_backend_sweeps_expired_files(tmp_path):
+    backend = FileBackend(str(tmp_path), ttl=30.0, max_files=100)
+    backend.set('feed', 'old', 'page', backend.token('feed'))
+
+    path = backend._path('feed', 'old')
+    os.utime(path, (time.time() - 60, time.time() - 60))
+    backend.sweep()
+
+    assert not os.path.exists(path)
+
+
+def test_render_started_before_invalidate_is_not_served():
+    backend = MemoryBackend()
+
+    token = backend.token('feed')
+    backend.invalidate('feed')
+    backend.set('feed', 'key', 'stale', token)
+
+    assert backend.get('feed', 'key') is None
+
+
+def test_request_key_follows_page_version():
+    # a fragment cached under one ETag must not be found under the next
+    with app.test_request_context('/'):
+        g.page_version = 'a'
+        first = request_key()
+        g.page_version = 'b'
+        assert request_key() != first
@@ -0,0 +1,33 @@
+import pytest
+
+from umbrella.view_counter import ViewCounter, MAX_ID
+
+
+def test_rejects_ids_outside_int4():
+    counter = ViewCounter(lambda deltas: None)
+
+    with pytest.raises(ValueError):
+        counter.add(MAX_ID + 1)
+    assert counter.stats()['buffered_hits'] == 0
+
+
+def test_failing_batch_is_dropped_after_max_retries():
+    written = []
+    failing = [True]
+
+    def flush(deltas):
+        if failing[0]:
+            raise RuntimeError("integer out of range")
+        written.append(deltas)
+
+    counter = ViewCounter(flush, max_retries=2)
+    counter.add(1)
+    for _ in range(3):
+        counter.flush()
+
+    failing[0] = False
+    counter.add(2)
+    counter.flush()
+
+    assert written == [{2: 1}]
+    assert counter.stats()['dropped_hits'] == 1
@@ -3,15 +3,52 @@ from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from  flask_ckeditor import CKEditor
 import os
+import tempfile
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('UMBRELLA_SECRET_KEY')
+# bcrypt cost for new hashes; older hashes are redone at the next login
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('UMBRELLA_BCRYPT_ROUNDS', 12))
+# hashing runs in its own processes; over BCRYPT_MAX_PENDING at once, requests wait up to
+# BCRYPT_QUEUE_TIMEOUT seconds for a slot and then get a 503
+app.config['BCRYPT_WORKERS'] = int(os.getenv('UMBRELLA_BCRYPT_WORKERS', min(2, os.cpu_count() or 1)))
+app.config['BCRYPT_MAX_PENDING'] = int(os.getenv('UMBRELLA_BCRYPT_MAX_PENDING', 8))
+app.config['BCRYPT_QUEUE_TIMEOUT'] = float(os.getenv('UMBRELLA_BCRYPT_QUEUE_TIMEOUT', 5))
 
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 app.config['CKEDITOR_PKG_TYPE'] = 'basic'
+app.config['SEARCH_MAX_COUNT'] = int(os.getenv('UMBRELLA_SEARCH_MAX_COUNT', 1000))
+
+# 'memory' (per process), 'filesystem' (shared by the workers of one host) or 'none'
+app.config['PAGE_CACHE_BACKEND'] = os.getenv('UMBRELLA_PAGE_CACHE', 'memory')
+app.config['PAGE_CACHE_DIR'] = os.getenv('UMBRELLA_PAGE_CACHE_DIR',
+                                         os.path.join(tempfile.gettempdir(), 'umbrella-page-cache'))
+app.config['PAGE_CACHE_TTL'] = float(os.getenv('UMBRELLA_PAGE_CACHE_TTL', 30))
+# most fragments kept; for 'filesystem', the most files in the directory
+app.config['PAGE_CACHE_SIZE'] = int(os.getenv('UMBRELLA_PAGE_CACHE_SIZE', 512))
+
+# Cache-Control per conditional route; responses to logged in users are always made private
+app.config['CACHE_CONTROL'] = {
+    'home': 'public, no-cache',
+    'post': 'public, no-cache',
+    'profile': 'public, max-age=60',
+    'search': 'public, max-age=30',
+}
+
+# per statement and per route SQL timings for /metrics, and the slow query log
+app.config['SQL_METRICS'] = os.getenv('UMBRELLA_SQL_METRICS', '1') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.getenv('UMBRELLA_SLOW_QUERY_MS', 250))
+# /metrics wants "Authorization: Bearer <token>", and answers 403 to everyone while this is unset
+app.config['METRICS_TOKEN'] = os.getenv('UMBRELLA_METRICS_TOKEN')
+# seconds a session keeps reading from the primary after it writes, when replicas are configured
+app.config['READ_YOUR_WRITES_S'] = float(os.getenv('UMBRELLA_READ_YOUR_WRITES_S', 5))
+# form validators keep Bloom filters of taken usernames, emails and titles, so a value
+# never used before skips the existence probe; rebuilt every UNIQUE_BLOOM_MAX_AGE seconds
+app.config['UNIQUE_BLOOM'] = os.getenv('UMBRELLA_UNIQUE_BLOOM', '0') == '1'
+app.config['UNIQUE_BLOOM_MAX_AGE'] = float(os.getenv('UMBRELLA_UNIQUE_BLOOM_MAX_AGE', 300))
 ckeditor = CKEditor(app)
 
 
-from umbrella import routes
\ No newline at end of file
+from umbrella import routes, cli, read_your_writes
\ No newline at end of file
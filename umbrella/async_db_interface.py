@@ -0,0 +1,214 @@
+import asyncio
+import contextvars
+import os
+import re
+import threading
+import time
+import umbrella.db_interface as db_interface
+from umbrella.db_interface import get_cond_q, get_select_q, get_limited_q, get_count_q, get_search_from_q, \
+    to_prefix_tsquery, returns_rows
+
+# optional; only needed when UMBRELLA_ASYNC_DB=1
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+def is_enabled():
+    return os.getenv('UMBRELLA_ASYNC_DB', '0') == '1'
+
+
+if is_enabled() and asyncpg is None:
+    raise RuntimeError("UMBRELLA_ASYNC_DB is set but asyncpg is not installed.")
+
+
+# one event loop per process, in its own thread; sync code hands it coroutines through run()
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+_pool = None
+_pool_lock = None
+
+
+def get_loop():
+    global _loop, _loop_pid
+
+    # started on first use, and again in a forked worker, whose copy of the thread is gone
+    if _loop is None or _loop_pid != os.getpid():
+        with _loop_lock:
+            if _loop is None or _loop_pid != os.getpid():
+                global _pool, _pool_lock
+                _pool, _pool_lock = None, None
+
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='umbrella-async-db', daemon=True).start()
+                _loop, _loop_pid = loop, os.getpid()
+
+    return _loop
+
+
+def run(coro, timeout=None):
+    # runs coro on the loop and waits for it; it sees the caller's context, so flask.g still works
+    loop = get_loop()
+    if threading.current_thread().name == 'umbrella-async-db':
+        raise RuntimeError("run() would block the loop it waits on; await the coroutine instead.")
+
+    context = contextvars.copy_context()
+    future = asyncio.run_coroutine_threadsafe(_in_context(coro, context), loop)
+    return future.result(timeout)
+
+
+async def _in_context(coro, context):
+    return await asyncio.get_running_loop().create_task(coro, context=context)
+
+
+def run_concurrently(*coros):
+    # the coroutines' queries are in flight at the same time, each on its own connection
+    async def gather():
+        return await asyncio.gather(*coros)
+
+    return run(gather())
+
+
+def asyncpg_params(params):
+    # the same database the sync layer writes to: libpq DSN keys, renamed for asyncpg
+    names = {'host': 'host', 'port': 'port', 'dbname': 'database', 'user': 'user', 'password': 'password',
+             'sslmode': 'ssl'}
+    unsupported = set(params) - set(names)
+    if unsupported:
+        raise RuntimeError(f"UMBRELLA_F_DB_DSN settings the async layer cannot use: {', '.join(sorted(unsupported))}.")
+
+    kwargs = {names[key]: value for key, value in params.items()}
+    if 'port' in kwargs:
+        kwargs['port'] = int(kwargs['port'])
+    return kwargs
+
+
+async def get_pool():
+    global _pool, _pool_lock
+
+    if asyncpg is None:
+        raise RuntimeError("asyncpg is not installed.")
+
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    **asyncpg_params(db_interface.dsn_params()),
+                    min_size=1,
+                    max_size=int(os.getenv('UMBRELLA_F_DB_POOL_SIZE', 10)),
+                    timeout=float(os.getenv('UMBRELLA_F_DB_POOL_TIMEOUT', 5)),
+                )
+
+    return _pool
+
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+_param_re = re.compile(r"%s")
+
+
+def to_asyncpg_q(query, field_param=None):
+    # the sync builders write psycopg2 SQL: {} for the field name and %s for values
+    if field_param:
+        query = query.format(quote_ident(field_param))
+
+    counter = iter(range(1, 1 << 16))
+    return _param_re.sub(lambda m: f"${next(counter)}", query)
+
+
+async def run_query(query: str, params=None, field_param=None, row_factory=None):
+    statement = to_asyncpg_q(query, field_param)
+    pool = await get_pool()
+
+    start = time.perf_counter()
+    async with pool.acquire() as conn:
+        acquired = time.perf_counter()
+        for listener in db_interface._acquire_listeners:
+            listener(acquired - start)
+
+        rows = ()
+        try:
+            if returns_rows(query):
+                # tuples, like psycopg2 returns, so the models can take either
+                records = await conn.fetch(statement, *(params or ()))
+                if row_factory is not None and records:
+                    build = row_factory(tuple(records[0].keys()))
+                    rows = [build(r) for r in records]
+                else:
+                    rows = [tuple(r) for r in records]
+            else:
+                await conn.execute(statement, *(params or ()))
+        finally:
+            if db_interface._query_listeners:
+                db_interface.notify_query(query, time.perf_counter() - acquired, len(rows))
+
+    return rows
+
+
+async def read_rows(table_name, limit=None, cond=None, use_like=False, offset=None, columns=None, row_factory=None):
+    where_query, params, field_param = get_cond_q(cond, use_like)
+    query = get_select_q(columns) + " FROM " + table_name + where_query
+
+    if limit:
+        query = get_limited_q(limit, query, offset)
+
+    return await run_query(query, params, field_param, row_factory)
+
+
+async def read_rows_in(table_name, field, values, row_factory=None):
+    if not values:
+        return []
+
+    query = "SELECT * FROM " + table_name + " WHERE {} = ANY(%s) AND is_deleted = False"
+    return await run_query(query, [list(values)], field, row_factory)
+
+
+async def count_rows(table_name, cond=None, use_like=False, max_count=None):
+    where_query, params, field_param = get_cond_q(cond, use_like)
+    query = get_count_q(" FROM " + table_name + where_query, max_count)
+
+    return (await run_query(query, params, field_param))[0][0]
+
+
+async def search_rows(table_name, text, limit=None, offset=None, vector_col='search_vector', columns=None,
+                      row_factory=None):
+    tsquery = to_prefix_tsquery(text)
+    if not tsquery:
+        return []
+
+    query = get_select_q(columns, alias='t') + get_search_from_q(table_name) + " ORDER BY ts_rank_cd(t.{0}, q) DESC, t.id DESC"
+
+    if limit:
+        query = get_limited_q(limit, query, offset)
+
+    return await run_query(query, [tsquery], vector_col, row_factory)
+
+
+async def count_search_rows(table_name, text, max_count=None, vector_col='search_vector'):
+    tsquery = to_prefix_tsquery(text)
+    if not tsquery:
+        return 0
+
+    query = get_count_q(get_search_from_q(table_name), max_count)
+    return (await run_query(query, [tsquery], vector_col))[0][0]
+
+
+async def insert_table(table_name, form_obj):
+    real_columns = db_interface.get_table_columns(table_name, writable=True)
+
+    col_values = db_interface.get_col_values(real_columns, form_obj)
+
+    column_str = ', '.join(real_columns)
+    param_str = ('%s,' * len(col_values)).rstrip(',')
+
+    insert_query = "INSERT INTO " + table_name + " (" + column_str + ") VALUES (" + param_str + ");"
+
+    await run_query(insert_query, col_values)
@@ -0,0 +1,225 @@
+import base64
+import csv
+import datetime
+import hashlib
+import json
+import os
+import random
+
+import bcrypt
+
+from umbrella import app
+import umbrella.db_interface as db_interface
+import umbrella.models as models
+
+# table -> {input field: (referenced table, natural key column, foreign key column)}
+FOREIGN_KEYS = {
+    'post': {
+        'author': ('profile', 'username', 'author_id'),
+        'category': ('category', 'title', 'category_id'),
+    },
+    'comment': {
+        'author': ('profile', 'username', 'author_id'),
+        'post': ('post', 'title', 'post_id'),
+    },
+}
+
+SYNTHETIC_EPOCH = datetime.datetime(2024, 1, 1)
+# bcrypt at the lowest cost: still unique per user, fast enough for thousands
+SYNTHETIC_ROUNDS = 4
+# standard base64 to the alphabet bcrypt salts are written in
+BCRYPT_B64 = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/",
+                             b"./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789")
+
+WORDS = [
+    'umbrella', 'rain', 'storm', 'forecast', 'cloud', 'thunder', 'drizzle', 'monsoon',
+    'weather', 'climate', 'python', 'flask', 'postgres', 'index', 'cache', 'search',
+    'garden', 'travel', 'recipe', 'bread', 'coffee', 'mountain', 'river', 'ocean',
+    'history', 'science', 'music', 'guitar', 'painting', 'camera', 'bicycle', 'running',
+]
+
+
+def get_model(table_name):
+    return next(m for m in models.db_models() if m.table_name == table_name)
+
+
+def get_load_columns(table_name):
+    # every writable column the model declares, in declaration order
+    declared = [col[0].strip('"') for col in get_model(table_name).db_columns]
+    writable = db_interface.get_table_columns(table_name, writable=True)
+    return [col for col in declared if col in writable]
+
+
+def get_defaults(now):
+    return {
+        'created_at': now,
+        'updated_at': now,
+        'is_deleted': False,
+        'view_count': 0,
+        'post_count': 0,
+    }
+
+
+def read_records(path):
+    with open(path, newline='') as f:
+        if path.endswith('.jsonl') or path.endswith('.ndjson'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def load_key_map(table_name, key_col):
+    keys = {}
+    for rows in db_interface.stream_query(f"SELECT {key_col}, id FROM {table_name} WHERE is_deleted = False"):
+        keys.update(rows)
+    return keys
+
+
+def load_key_maps(table_name):
+    # read before the COPY starts, since the connection is busy until it ends
+    key_maps = {}
+    for field, (ref_table, key_col, fk_col) in FOREIGN_KEYS.get(table_name, {}).items():
+        key_maps[field] = (load_key_map(ref_table, key_col), fk_col)
+    return key_maps
+
+
+def map_records(table_name, records, columns, key_maps=None):
+    # resolves natural keys (username, title) to ids and fills in column defaults
+    defaults = get_defaults(datetime.datetime.now())
+
+    for record in records:
+        record = dict(record)
+        for field, (keys, fk_col) in (key_maps or {}).items():
+            if field in record and fk_col not in record:
+                try:
+                    record[fk_col] = keys[record.pop(field)]
+                except KeyError as e:
+                    raise ValueError(f"{table_name}: no {field} with key {e.args[0]!r}.")
+
+        row = []
+        for col in columns:
+            value = record.get(col)
+            if value in (None, '') and col in defaults:
+                value = defaults[col]
+            row.append(value)
+        yield row
+
+
+def load_file(table_name, path):
+    columns = [col for col in get_load_columns(table_name) if col != 'id']
+
+    with db_interface.transaction():
+        records = map_records(table_name, read_records(path), columns, load_key_maps(table_name))
+        count = db_interface.copy_rows(table_name, columns, records)
+
+    if table_name == 'post':
+        refresh_post_counts()
+    return count
+
+
+def refresh_post_counts():
+    db_interface.run_query(
+        """
+        UPDATE category c SET post_count = coalesce(p.n, 0)
+        FROM category c2
+            LEFT JOIN (SELECT category_id, count(*) AS n FROM post WHERE is_deleted = False GROUP BY category_id) p
+            ON p.category_id = c2.id
+        WHERE c.id = c2.id;
+        """
+    )
+
+
+def get_next_id(table_name):
+    return db_interface.run_query(f"SELECT coalesce(max(id), 0) + 1 FROM {table_name}")[0][0]
+
+
+def sync_sequence(table_name):
+    # rows were copied with explicit ids, so move the serial past them
+    db_interface.run_query(
+        f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), coalesce(max(id), 1)) FROM {table_name}"
+    )
+
+
+def synthetic_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def synthetic_password_hash(seed, id):
+    # the salt is derived from the seed and the id instead of drawn at random,
+    # so the same seed always produces the same hashes
+    digest = hashlib.sha256(f"{seed}-profile-{id}".encode('utf-8')).digest()[:16]
+    salt = f"$2b${SYNTHETIC_ROUNDS:02d}$".encode('utf-8') + base64.b64encode(digest)[:22].translate(BCRYPT_B64)
+
+    password = f"password{id}".encode('utf-8')
+    if app.config.get('BCRYPT_HANDLE_LONG_PASSWORDS'):
+        # the pre-hash flask_bcrypt applies, so these still verify at login
+        password = hashlib.sha256(password).hexdigest().encode('utf-8')
+
+    return bcrypt.hashpw(password, salt).decode('utf-8')
+
+
+def synthetic_rows(table_name, count, first_id, seed, refs):
+    # every value depends only on the seed and the row number, never on the clock
+    rng = random.Random(f"{seed}-{table_name}")
+
+    for n in range(count):
+        id = first_id + n
+        created_at = SYNTHETIC_EPOCH + datetime.timedelta(minutes=n)
+
+        if table_name == 'profile':
+            row = {'id': id, 'username': f"user{id}", 'email': f"user{id}@example.com",
+                   'password': synthetic_password_hash(seed, id), 'bio': synthetic_text(rng, 8), 'created_at': created_at}
+        elif table_name == 'category':
+            row = {'id': id, 'title': f"{rng.choice(WORDS).title()} {id}",
+                   'description': synthetic_text(rng, 10), 'post_count': 0}
+        elif table_name == 'post':
+            row = {'id': id, 'title': f"{synthetic_text(rng, 4)} {id}",
+                   'content': '<p>' + synthetic_text(rng, rng.randint(50, 400)) + '</p>',
+                   'created_at': created_at, 'view_count': rng.randint(0, 5000),
+                   'author_id': rng.choice(refs['profile']), 'category_id': rng.choice(refs['category'])}
+        else:
+            row = {'id': id, 'content': synthetic_text(rng, rng.randint(5, 60)), 'created_at': created_at,
+                   'author_id': rng.choice(refs['profile']), 'post_id': rng.choice(refs['post'])}
+
+        row.setdefault('updated_at', created_at)
+        yield row
+
+
+def load_synthetic(sizes: dict, seed=0, echo=print):
+    # sizes maps each table name to a row count; referenced tables are loaded first
+    refs = {}
+    counts = {}
+
+    for table_name in ('profile', 'category', 'post', 'comment'):
+        count = sizes.get(table_name, 0)
+        first_id = get_next_id(table_name)
+        columns = get_load_columns(table_name)
+
+        with db_interface.transaction():
+            records = synthetic_rows(table_name, count, first_id, seed, refs)
+            counts[table_name] = db_interface.copy_rows(table_name, columns,
+                                                        map_records(table_name, records, columns))
+            sync_sequence(table_name)
+
+        refs[table_name] = range(first_id, first_id + count) or range(1, first_id)
+        echo(f"{table_name}: {counts[table_name]} rows")
+
+    refresh_post_counts()
+    return counts
+
+
+# file name, without extensions -> table; anything else needs --table
+FILE_TABLES = {
+    'profile': 'profile', 'profiles': 'profile', 'user': 'profile', 'users': 'profile',
+    'category': 'category', 'categories': 'category',
+    'post': 'post', 'posts': 'post',
+    'comment': 'comment', 'comments': 'comment',
+}
+
+
+def get_file_table(path):
+    # posts.csv -> post, categories.jsonl -> category; None when the name is not a known table
+    name = os.path.basename(path).split('.')[0].lower()
+    return FILE_TABLES.get(name)
@@ -0,0 +1,116 @@
+import logging
+import select
+import threading
+import time
+
+import umbrella.db_interface as db_interface
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'umbrella_category_changed'
+
+NOTIFY_TRIGGER_DDL = f"""
+CREATE OR REPLACE FUNCTION umbrella_notify_category_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS category_changed_notify ON category;
+CREATE TRIGGER category_changed_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON category
+    FOR EACH STATEMENT EXECUTE FUNCTION umbrella_notify_category_changed();
+"""
+
+
+def install_notify_trigger():
+    db_interface.run_query(NOTIFY_TRIGGER_DDL)
+
+
+class CategoryDirectory():
+    def __init__(self, load, channel=CHANNEL, max_age=300.0, reconnect_delay=5.0):
+        # load returns every live category; it is called again on each NOTIFY
+        self._load = load
+        self.channel = channel
+
+        # reload anyway after this many seconds, in case a notification was lost
+        self.max_age = max_age
+        self.reconnect_delay = reconnect_delay
+
+        # (by id, by title), swapped as a whole on reload
+        self._index = ({}, {})
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._listener = None
+
+        self.reloads = 0
+        self.notifications = 0
+
+    def reload(self):
+        cats = self._load()
+
+        self._index = ({cat.id: cat for cat in cats}, {cat.title: cat for cat in cats})
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+
+    def _ensure_loaded(self):
+        # loaded on first use rather than at import, so forked workers each start their own listener
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.max_age:
+            return
+
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.max_age:
+                self.reload()
+
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='umbrella-category-listener',
+                                                  daemon=True)
+                self._listener.start()
+
+    def all(self):
+        self._ensure_loaded()
+        return list(self._index[0].values())
+
+    def get(self, id):
+        self._ensure_loaded()
+        return self._index[0].get(id)
+
+    def find(self, title):
+        self._ensure_loaded()
+        return self._index[1].get(title)
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = db_interface.open_conn()
+                conn.autocommit = True
+                conn.cursor().execute("LISTEN " + self.channel)
+
+                # anything that changed while we were not listening
+                self.reload()
+
+                while True:
+                    if select.select([conn], [], [], self.max_age) == ([], [], []):
+                        continue
+
+                    conn.poll()
+                    if conn.notifies:
+                        self.notifications += len(conn.notifies)
+                        conn.notifies.clear()
+                        self.reload()
+            except Exception:
+                logger.exception("Category listener lost its connection; retrying.")
+            finally:
+                if conn is not None:
+                    conn.close()
+
+            time.sleep(self.reconnect_delay)
+
+    def stats(self):
+        return {
+            'categories': len(self._index[0]),
+            'reloads': self.reloads,
+            'notifications': self.notifications,
+        }
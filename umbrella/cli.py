@@ -0,0 +1,98 @@
+import click
+from flask.cli import AppGroup
+from umbrella import app
+import umbrella.bulk_load as bulk_load
+import umbrella.db_interface as db_interface
+import umbrella.schema as schema
+
+
+umbrella_cli = AppGroup('umbrella', help='Umbrella maintenance commands.')
+
+
+@umbrella_cli.command('sync-schema')
+@click.option('--dry-run', is_flag=True, help='Only report what would be created.')
+@click.option('--no-concurrently', is_flag=True, help='Build indexes with a plain, locking CREATE INDEX.')
+def sync_schema(dry_run, no_concurrently):
+    """Create missing tables, columns and declared indexes."""
+    report = schema.sync_schema(concurrently=not no_concurrently, dry_run=dry_run)
+    verb = 'Would create' if dry_run else 'Created'
+
+    for kind, label in (('tables', 'table'), ('columns', 'column'), ('indexes', 'index')):
+        for name in report[kind]:
+            click.echo(f'{verb} {label} {name}')
+
+    if not (report['tables'] or report['columns'] or report['indexes']):
+        click.echo('Tables, columns and indexes are up to date.')
+
+    for name in report['triggers']:
+        click.echo(f'{"Would install" if dry_run else "Installed"} trigger {name}')
+
+
+@umbrella_cli.command('index-report')
+def index_report():
+    """Report missing, invalid, unused and undeclared indexes."""
+    report = schema.index_report()
+
+    for table_name, index_name in report['missing']:
+        click.echo(f'missing     {table_name}.{index_name}')
+    for table_name, index_name in report['invalid']:
+        click.echo(f'invalid     {table_name}.{index_name}')
+    for table_name, index_name, size in report['unused']:
+        click.echo(f'unused      {table_name}.{index_name} ({size} bytes, no scans)')
+    for table_name, index_name in report['undeclared']:
+        click.echo(f'undeclared  {table_name}.{index_name}')
+
+
+@umbrella_cli.command('bulk-load')
+@click.option('--table', type=click.Choice(['profile', 'category', 'post', 'comment']),
+              help='Target table; guessed from the file name when omitted.')
+@click.option('--file', 'path', type=click.Path(exists=True, dir_okay=False), help='CSV or JSONL file to load.')
+@click.option('--synthetic', is_flag=True, help='Generate a deterministic fake dataset instead.')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--categories', default=20, show_default=True)
+@click.option('--posts', default=100000, show_default=True)
+@click.option('--comments', default=500000, show_default=True)
+@click.option('--seed', default=0, show_default=True)
+def bulk_load_command(table, path, synthetic, users, categories, posts, comments, seed):
+    """Load rows with COPY, from a file or generated.
+
+    File columns are matched to the model's db_columns; posts and comments may
+    name their author by username, category by title and post by title instead
+    of giving the ids.
+    """
+    if synthetic == bool(path):
+        raise click.UsageError('Give exactly one of --file and --synthetic.')
+
+    if synthetic:
+        sizes = {'profile': users, 'category': categories, 'post': posts, 'comment': comments}
+        bulk_load.load_synthetic(sizes, seed=seed, echo=click.echo)
+        return
+
+    table = table or bulk_load.get_file_table(path)
+    if table not in ('profile', 'category', 'post', 'comment'):
+        raise click.UsageError(f'Cannot tell the table from {path}; pass --table.')
+
+    try:
+        count = bulk_load.load_file(table, path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{table}: {count} rows')
+
+
+@umbrella_cli.command('replica-status')
+def replica_status():
+    """Check every configured read replica now and report its lag."""
+    replicas = db_interface.get_replicas()
+    if replicas is None:
+        click.echo('No replicas configured; set UMBRELLA_F_DB_REPLICA_DSNS.')
+        return
+
+    for index, dsn in enumerate(db_interface.REPLICA_DSNS):
+        try:
+            healthy = replicas.check(index)
+            click.echo(f'{index}  {"ok" if healthy else "behind"}  lag {replicas.lag[index]:.2f}s  {dsn}')
+        except Exception as e:
+            click.echo(f'{index}  down  {e.__class__.__name__}: {str(e).strip()}  {dsn}')
+
+
+app.cli.add_command(umbrella_cli)
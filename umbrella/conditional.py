@@ -0,0 +1,68 @@
+import functools
+import hashlib
+import time
+
+from flask import g, request, session, make_response
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+from umbrella import app
+import umbrella.db_interface as db_interface
+
+
+def get_etag(parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def conditional(policy, validator, csrf_bound=False):
+    # validator gets the view's arguments and returns (version parts, last modified) or None;
+    # when the client already has that version the view is never called
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # pending flashes are rendered into the page, so it cannot be replaced by a 304
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            version = validator(*args, **kwargs)
+            if version is None:
+                return view(*args, **kwargs)
+
+            parts, last_modified = version
+            auth = current_user.id if current_user.is_authenticated else None
+            parts = [parts, request.full_path, auth]
+
+            if csrf_bound:
+                # the page embeds a CSRF token; let it be renewed well within its time limit
+                csrf_limit = app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+                parts.append(int(time.time() // (csrf_limit / 2)))
+
+            etag = get_etag(parts)
+            # part of the page cache keys, so a fragment rendered under an older version
+            # is never sent out under this ETag
+            g.page_version = etag
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = app.response_class(status=304)
+            else:
+                # the version came from the primary; a replica could render an older body under it
+                db_interface.pin_to_primary()
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+
+            cache_control = app.config['CACHE_CONTROL'].get(policy, 'no-cache')
+            if auth is not None:
+                cache_control = 'private, ' + cache_control
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add('Cookie')
+
+            return response
+
+        return wrapper
+
+    return decorator
@@ -1,75 +1,546 @@
+import csv
 import datetime
+import functools
+import io
+import itertools
 import os
+import re
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
 import psycopg2.sql as sql
+from umbrella.db_pool import ConnectionPool, PoolTimeout, ReplicaSet
 
+PRIMARY_DSN = os.getenv('UMBRELLA_F_DB_DSN', "host=localhost dbname=umbrella_flask port=5433")
 
-def open_conn():
-    conn = psycopg2.connect(
-        host="localhost",
-        database="umbrella_flask",
-        user=os.getenv('UMBRELLA_F_DB_USER'),
-        password=os.getenv('UMBRELLA_F_DB_PASS'),
-        port=5433
-    )
+# comma separated; reads go here when set, e.g. "host=localhost port=5434 dbname=umbrella_flask"
+REPLICA_DSNS = [dsn.strip() for dsn in os.getenv('UMBRELLA_F_DB_REPLICA_DSNS', '').split(',') if dsn.strip()]
+
+
+def dsn_params(dsn=None):
+    # the DSN's settings as a dict; credentials come from the environment unless the DSN has its own
+    params = psycopg2.extensions.parse_dsn(dsn or PRIMARY_DSN)
+    for key, env in (('user', 'UMBRELLA_F_DB_USER'), ('password', 'UMBRELLA_F_DB_PASS')):
+        if key not in params and os.getenv(env) is not None:
+            params[key] = os.getenv(env)
+
+    return params
+
+
+def open_conn(dsn=None):
+    conn = psycopg2.connect(**dsn_params(dsn))
 
     return conn
 
 
-def run_query(query: str, params=None, field_param=None):
-    with open_conn() as conn:
-        cursor = conn.cursor()
+_pool = None
+_replicas = None
+_pool_lock = threading.Lock()
 
-        if params:
-            if field_param:
-                formatted_query = sql.SQL(query).format(sql.Identifier(field_param))
-                cursor.execute(formatted_query, params)
-            else:
-                cursor.execute(query, params)
-        else:
-            cursor.execute(query)
 
-        conn.commit()
+# created on first use so that forked worker processes never share sockets
+def get_pool():
+    global _pool
 
-        if cursor.description:
-            rows = cursor.fetchall()
-            return rows
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    open_conn,
+                    max_size=int(os.getenv('UMBRELLA_F_DB_POOL_SIZE', 10)),
+                    timeout=float(os.getenv('UMBRELLA_F_DB_POOL_TIMEOUT', 5)),
+                )
 
-        rows = ()
-        return rows
+    return _pool
 
 
-def read_rows(table_name, limit=None, cond=None, use_like=False):
-    if cond:
-        params = [cond[1]]
-        if use_like:
-            query = "SELECT * FROM " + table_name + " WHERE {} LIKE %s AND is_deleted = False"
-            params = [f'%{cond[1]}%']
-        else:
-            query = "SELECT * FROM " + table_name + " WHERE {} = %s AND is_deleted = False"
+def get_replicas():
+    # None when no replicas are configured
+    global _replicas
 
-        field_param = cond[0]
+    if _replicas is None and REPLICA_DSNS:
+        with _pool_lock:
+            if _replicas is None:
+                pools = [
+                    ConnectionPool(
+                        functools.partial(open_conn, dsn),
+                        max_size=int(os.getenv('UMBRELLA_F_DB_POOL_SIZE', 10)),
+                        timeout=float(os.getenv('UMBRELLA_F_DB_POOL_TIMEOUT', 5)),
+                    )
+                    for dsn in REPLICA_DSNS
+                ]
+                _replicas = ReplicaSet(
+                    pools,
+                    max_lag=float(os.getenv('UMBRELLA_F_DB_REPLICA_MAX_LAG', 30)),
+                    retry_after=float(os.getenv('UMBRELLA_F_DB_REPLICA_RETRY', 30)),
+                )
 
-        if limit:
-            limit_query = get_limited_q(limit, query)
-            rows = run_query(limit_query, params, field_param)
-        else:
-            rows = run_query(query, params, field_param)
+    return _replicas
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def replica_stats():
+    replicas = get_replicas()
+    return replicas.stats() if replicas else []
+
+
+_query_listeners = []
+_acquire_listeners = []
+
+
+def add_query_listener(listener):
+    # listener(statement, seconds, rows) is called once for every statement sent to the server
+    _query_listeners.append(listener)
 
-    else:
-        query = "SELECT * FROM " + table_name + " WHERE is_deleted = False"
 
-        if limit:
-            limit_query = get_limited_q(limit, query)
-            rows = run_query(limit_query)
+def remove_query_listener(listener):
+    _query_listeners.remove(listener)
+
+
+def add_acquire_listener(listener):
+    # listener(seconds) is called each time a connection is taken from the pool
+    _acquire_listeners.append(listener)
+
+
+def remove_acquire_listener(listener):
+    _acquire_listeners.remove(listener)
+
+
+def notify_query(statement, seconds, rows=-1):
+    for listener in _query_listeners:
+        listener(statement, seconds, rows)
+
+
+def timed_execute(cursor, query, params=None, statement=None):
+    # statement is what the listeners see when query is not a plain string
+    if not _query_listeners:
+        cursor.execute(query, params)
+        return
+
+    start = time.perf_counter()
+    try:
+        cursor.execute(query, params)
+    finally:
+        notify_query(statement or query, time.perf_counter() - start, cursor.rowcount)
+
+
+@contextmanager
+def pooled_connection(pool=None):
+    pool = pool or get_pool()
+    if not _acquire_listeners:
+        with pool.connection() as conn:
+            yield conn
+        return
+
+    start = time.perf_counter()
+    with pool.connection() as conn:
+        seconds = time.perf_counter() - start
+        for listener in _acquire_listeners:
+            listener(seconds)
+        yield conn
+
+
+def execute_query(cursor, query, params=None, field_param=None):
+    if params:
+        if field_param:
+            formatted_query = sql.SQL(query).format(sql.Identifier(field_param))
+            timed_execute(cursor, formatted_query, params, statement=query)
         else:
-            rows = run_query(query)
+            timed_execute(cursor, query, params)
+    else:
+        timed_execute(cursor, query)
 
+    if cursor.description:
+        rows = cursor.fetchall()
+        return rows
+
+    rows = ()
     return rows
 
 
-def get_limited_q(limit, query):
-    return query + " LIMIT " + str(limit)
+class MappingCursor(psycopg2.extensions.cursor):
+    # row_factory(column names) returns a function that builds one object from one row;
+    # it is looked up once per fetch, so it should cache what it compiles
+    row_factory = None
+
+    def _map(self, rows):
+        if self.row_factory is None or not rows:
+            return rows
+
+        build = self.row_factory(tuple(col.name for col in self.description))
+        return [build(row) for row in rows]
+
+    def fetchall(self):
+        return self._map(super().fetchall())
+
+    def fetchmany(self, size=None):
+        return self._map(super().fetchmany(self.arraysize if size is None else size))
+
+    def fetchone(self):
+        row = super().fetchone()
+        return self._map([row])[0] if row is not None else None
+
+
+def get_cursor(conn, row_factory=None, name=None):
+    if row_factory is None:
+        return conn.cursor(name=name)
+
+    cursor = conn.cursor(name=name, cursor_factory=MappingCursor)
+    cursor.row_factory = row_factory
+    return cursor
+
+
+class Transaction():
+    def __init__(self, conn, batch=False):
+        self.conn = conn
+        self.batch = batch
+        self.savepoints = 0
+        self._pending = []
+
+    def run_query(self, query, params=None, field_param=None, row_factory=None):
+        cursor = get_cursor(self.conn, row_factory)
+
+        if self.batch and not returns_rows(query):
+            # held back and sent together with the other writes of the transaction;
+            # listeners get the statement without its values, which may be secrets
+            statement = query
+            if params and field_param:
+                query = sql.SQL(query).format(sql.Identifier(field_param))
+            self._pending.append((statement, cursor.mogrify(query, params or None)))
+            note_write()
+            return ()
+
+        # reads must see the writes queued before them
+        self.flush()
+        if not returns_rows(query):
+            note_write()
+        return execute_query(cursor, query, params, field_param)
+
+    def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            query = b";\n".join(mogrified for _, mogrified in pending)
+            statement = ";\n".join(statement for statement, _ in pending) if _query_listeners else None
+            timed_execute(self.conn.cursor(), query, statement=statement)
+
+
+def returns_rows(query):
+    statement = query.lstrip().upper()
+    return statement.startswith(("SELECT", "WITH")) or " RETURNING " in statement
+
+
+_local = threading.local()
+
+
+def current_transaction():
+    return getattr(_local, 'transaction', None)
+
+
+def note_write():
+    _local.wrote = True
+
+
+def take_write_flag():
+    # whether this thread wrote to the primary since the last call
+    wrote = getattr(_local, 'wrote', False)
+    _local.wrote = False
+    return wrote
+
+
+def pin_to_primary(pinned=True):
+    # a pinned thread reads from the primary too, e.g. right after its session wrote something
+    _local.pinned = pinned
+
+
+def get_read_pool():
+    # a replica's pool, or None for the primary
+    if getattr(_local, 'pinned', False):
+        return None
+
+    replicas = get_replicas()
+    return replicas.choose() if replicas else None
+
+
+@contextmanager
+def transaction(batch=False):
+    # every run_query inside the block shares one connection and one commit;
+    # a nested block becomes a savepoint of the outer transaction
+    outer = current_transaction()
+    if outer is not None:
+        with savepoint():
+            yield outer
+        return
+
+    with pooled_connection() as conn:
+        tx = Transaction(conn, batch)
+        _local.transaction = tx
+        try:
+            yield tx
+            tx.flush()
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            _local.transaction = None
+
+
+@contextmanager
+def savepoint():
+    tx = current_transaction()
+    if tx is None:
+        raise RuntimeError("savepoint() used outside of a transaction.")
+
+    tx.flush()
+    tx.savepoints += 1
+    name = f"umbrella_sp_{tx.savepoints}"
+
+    cursor = tx.conn.cursor()
+    timed_execute(cursor, "SAVEPOINT " + name)
+    try:
+        yield tx
+        tx.flush()
+    except Exception:
+        tx._pending = []
+        timed_execute(cursor, "ROLLBACK TO SAVEPOINT " + name)
+        raise
+    timed_execute(cursor, "RELEASE SAVEPOINT " + name)
+
+
+def run_query(query: str, params=None, field_param=None, row_factory=None, replica=False):
+    # replica=True lets a plain read go to a replica; transactions and writes stay on the primary
+    tx = current_transaction()
+    if tx is not None:
+        return tx.run_query(query, params, field_param, row_factory)
+
+    read_pool = get_read_pool() if replica else None
+    if read_pool is not None:
+        try:
+            with pooled_connection(read_pool) as conn:
+                cursor = get_cursor(conn, row_factory)
+                rows = execute_query(cursor, query, params, field_param)
+                conn.rollback()
+
+                return rows
+        except (psycopg2.OperationalError, PoolTimeout):
+            # the primary answers instead, and the replica is skipped for a while
+            get_replicas().mark_down(read_pool)
+
+    if not returns_rows(query):
+        note_write()
+
+    for retry in (True, False):
+        conn, executed = None, False
+        try:
+            with pooled_connection() as conn:
+                cursor = get_cursor(conn, row_factory)
+                rows = execute_query(cursor, query, params, field_param)
+                executed = True
+                conn.commit()
+
+                return rows
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # a connection that died while idle, e.g. over a restart: nothing was committed on it,
+            # so the statement is sent once more, on a connection the pool has now checked.
+            # errors on a live connection (timeouts, deadlocks) are not retried
+            if executed or not retry or conn is None or not conn.closed:
+                raise
+
+
+_stream_ids = itertools.count()
+
+
+def stream_query(query: str, params=None, field_param=None, batch_size=500, row_factory=None):
+    # yields lists of at most batch_size rows from a named, server side cursor,
+    # so only one batch is ever held in memory
+    tx = current_transaction()
+    if tx is not None:
+        tx.flush()
+        yield from _stream_on(tx.conn, query, params, field_param, batch_size, row_factory)
+        return
+
+    # while the stream is open it is the thread's transaction, so the queries run between its
+    # batches (stream_posts' author lookups) share its connection instead of taking a second one
+    with pooled_connection() as conn:
+        tx = Transaction(conn)
+        _local.transaction = tx
+        try:
+            yield from _stream_on(conn, query, params, field_param, batch_size, row_factory)
+            tx.flush()
+            conn.commit()
+        finally:
+            _local.transaction = None
+            # a no-op after the commit; undoes everything when the stream is abandoned
+            if not conn.closed:
+                conn.rollback()
+
+
+def _stream_on(conn, query, params, field_param, batch_size, row_factory=None):
+    cursor = get_cursor(conn, row_factory, name=f"umbrella_stream_{next(_stream_ids)}")
+    cursor.itersize = batch_size
+    try:
+        statement = query
+        if params and field_param:
+            query = sql.SQL(query).format(sql.Identifier(field_param))
+        timed_execute(cursor, query, params or None, statement=statement)
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        try:
+            cursor.close()
+        except psycopg2.Error:
+            # the transaction already failed; rolling it back drops the cursor too
+            pass
+
+
+def get_cond_q(cond=None, use_like=False):
+    if not cond:
+        return " WHERE is_deleted = False", None, None
+
+    if use_like:
+        return " WHERE {} LIKE %s AND is_deleted = False", [f'%{cond[1]}%'], cond[0]
+
+    return " WHERE {} = %s AND is_deleted = False", [cond[1]], cond[0]
+
+
+def get_select_q(columns=None, alias=None):
+    # column projection; no columns selects every one
+    prefix = alias + "." if alias else ""
+    if not columns:
+        return "SELECT " + prefix + "*"
+
+    return "SELECT " + ", ".join(prefix + col for col in columns)
+
+
+def read_rows(table_name, limit=None, cond=None, use_like=False, offset=None, columns=None, row_factory=None):
+    where_query, params, field_param = get_cond_q(cond, use_like)
+    query = get_select_q(columns) + " FROM " + table_name + where_query
+
+    if limit:
+        query = get_limited_q(limit, query, offset)
+
+    return run_query(query, params, field_param, row_factory, replica=True)
+
+
+def read_rows_after(table_name, key_cols: list, after=None, limit=20, cond=None, columns=None, row_factory=None):
+    # keyset paging, newest first: rows strictly after the key of the last row seen
+    # so a deep page costs the same index range scan as the first one
+    where_query, params, field_param = get_cond_q(cond)
+    params = params or []
+
+    if after:
+        where_query += " AND (" + ", ".join(key_cols) + ") < (" + ", ".join(["%s"] * len(key_cols)) + ")"
+        params.extend(after)
+
+    order_query = " ORDER BY " + ", ".join(col + " DESC" for col in key_cols)
+    query = get_limited_q(limit, get_select_q(columns) + " FROM " + table_name + where_query + order_query)
+
+    return run_query(query, params or None, field_param, row_factory, replica=True)
+
+
+def stream_rows(table_name, cond=None, use_like=False, batch_size=500, columns=None, row_factory=None):
+    where_query, params, field_param = get_cond_q(cond, use_like)
+    query = get_select_q(columns) + " FROM " + table_name + where_query + " ORDER BY id"
+
+    return stream_query(query, params, field_param, batch_size, row_factory)
+
+
+def get_count_q(from_query, max_count=None):
+    # a capped count stops scanning once max_count rows have matched
+    if max_count:
+        return "SELECT count(*) FROM (SELECT 1" + from_query + " LIMIT " + str(max_count) + ") capped"
+
+    return "SELECT count(*)" + from_query
+
+
+def find_existing(table_name, values: dict):
+    # the columns of values that some row already holds, all in one round trip;
+    # each EXISTS stops at the first index entry instead of fetching whole rows.
+    # soft deleted rows count too, since the unique constraints cover them
+    if not values:
+        return set()
+
+    fields = list(values)
+    query = "SELECT " + ", ".join(f"EXISTS (SELECT 1 FROM {table_name} WHERE {field} = %s)" for field in fields)
+    row = run_query(query, [values[field] for field in fields], replica=True)[0]
+
+    return {field for field, taken in zip(fields, row) if taken}
+
+
+def count_rows(table_name, cond=None, use_like=False, max_count=None):
+    where_query, params, field_param = get_cond_q(cond, use_like)
+    query = get_count_q(" FROM " + table_name + where_query, max_count)
+
+    return run_query(query, params, field_param, replica=True)[0][0]
+
+
+def read_rows_in(table_name, field, values, row_factory=None):
+    # fetches every row whose field matches one of the values in a single round trip
+    if not values:
+        return []
+
+    query = "SELECT * FROM " + table_name + " WHERE {} = ANY(%s) AND is_deleted = False"
+    return run_query(query, [list(values)], field, row_factory, replica=True)
+
+
+def to_prefix_tsquery(text):
+    # every word of the search text must match, each one as a prefix
+    words = re.findall(r"\w+", text.lower())
+    return " & ".join(word + ":*" for word in words)
+
+
+def get_search_from_q(table_name):
+    return " FROM " + table_name + " t, to_tsquery('english', %s) q " \
+           "WHERE t.{0} @@ q AND t.is_deleted = False"
+
+
+def search_rows(table_name, text, limit=None, offset=None, vector_col='search_vector', columns=None,
+                row_factory=None):
+    tsquery = to_prefix_tsquery(text)
+    if not tsquery:
+        return []
+
+    query = get_select_q(columns, alias='t') + get_search_from_q(table_name) + " ORDER BY ts_rank_cd(t.{0}, q) DESC, t.id DESC"
+
+    if limit:
+        query = get_limited_q(limit, query, offset)
+
+    return run_query(query, [tsquery], vector_col, row_factory, replica=True)
+
+
+def count_search_rows(table_name, text, max_count=None, vector_col='search_vector'):
+    tsquery = to_prefix_tsquery(text)
+    if not tsquery:
+        return 0
+
+    query = get_count_q(get_search_from_q(table_name), max_count)
+    return run_query(query, [tsquery], vector_col, replica=True)[0][0]
+
+
+def add_column(table_name, column: tuple):
+    column_name, data_type, *modifiers = column
+
+    query = f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column_name} {data_type} {' '.join(modifiers)};"
+    run_query(query)
+    invalidate_table_columns(table_name)
+
+
+def get_limited_q(limit, query, offset=None):
+    query = query + " LIMIT " + str(limit)
+
+    if offset:
+        query += " OFFSET " + str(offset)
+
+    return query
 
 
 def create_table(table_name, columns: list[tuple]):
@@ -92,6 +563,47 @@ def create_table(table_name, columns: list[tuple]):
 
     query += "\n);"
     run_query(query)
+    invalidate_table_columns(table_name)
+
+def run_autocommit(query: str, params=None):
+    # for statements that cannot run inside a transaction block, like CREATE INDEX CONCURRENTLY
+    with pooled_connection() as conn:
+        conn.autocommit = True
+        try:
+            return execute_query(conn.cursor(), query, params)
+        finally:
+            conn.autocommit = False
+
+
+def create_index(table_name, index: tuple, concurrently=True):
+    index_name, method, columns, *modifiers = index
+
+    query = "CREATE INDEX " + ("CONCURRENTLY " if concurrently else "") + \
+            f"IF NOT EXISTS {index_name} ON {table_name} USING {method} ({columns})"
+    if modifiers:
+        query += " " + " ".join(modifiers)
+
+    run_autocommit(query + ";")
+
+
+def get_index_stats(table_names):
+    query = \
+        """
+        SELECT
+            s.relname, s.indexrelname, s.idx_scan, pg_relation_size(s.indexrelid),
+            i.indisvalid, i.indisunique OR i.indisprimary
+        FROM
+            pg_stat_user_indexes s
+            JOIN pg_index i ON i.indexrelid = s.indexrelid
+        WHERE
+            s.schemaname = current_schema() AND
+            s.relname = ANY(%s)
+        ORDER BY
+            s.relname, s.indexrelname;
+        """
+
+    return run_query(query, [list(table_names)])
+
 
 def flatten_query_result(jagged_list):
     flat_list = []
@@ -111,23 +623,60 @@ def get_col_values(columns, obj):
         column_values.append(value)
     return column_values
 
-def get_table_columns(table_name):
+# per-process cache of table name -> (column name, is generated) pairs, in table order
+_table_columns = {}
+
+
+def load_table_columns(table_names):
     get_columns_query = \
-        f"""
+        """
         SELECT
-            column_name
+            table_name, column_name, is_generated
         FROM
             information_schema.columns
         WHERE
-            table_name = '{table_name}';
+            table_schema = current_schema() AND
+            table_name = ANY(%s)
+        ORDER BY
+            table_name, ordinal_position;
         """
 
-    table_columns = run_query(get_columns_query)
-    table_columns_flat = flatten_query_result(table_columns)
-    return table_columns_flat
+    loaded = {}
+    for table_name, column_name, is_generated in run_query(get_columns_query, [list(table_names)]):
+        loaded.setdefault(table_name, []).append((column_name, is_generated == 'ALWAYS'))
+
+    _table_columns.update(loaded)
+    return loaded
+
+
+def get_table_columns(table_name, writable=False):
+    table_columns = _table_columns.get(table_name)
+    if table_columns is None:
+        # missing tables are not cached so they are picked up once created
+        table_columns = load_table_columns([table_name]).get(table_name, [])
+
+    # generated columns can be read but never written; callers mutate the list they get back
+    return [col for col, generated in table_columns if not (writable and generated)]
+
+
+def invalidate_table_columns(table_name=None):
+    if table_name:
+        _table_columns.pop(table_name, None)
+    else:
+        _table_columns.clear()
+
+
+def check_table_columns(table_name, declared_columns: list[tuple]):
+    declared = [col[0].strip('"') for col in declared_columns]
+    real = get_table_columns(table_name)
+
+    missing = [col for col in declared if col not in real]
+    undeclared = [col for col in real if col not in declared]
+    return missing, undeclared
+
 
 def insert_table(table_name, form_obj):
-    real_columns = get_table_columns(table_name)
+    real_columns = get_table_columns(table_name, writable=True)
 
     col_values = get_col_values(real_columns, form_obj)
 
@@ -139,7 +688,68 @@ def insert_table(table_name, form_obj):
     run_query(insert_query, col_values)
 
 
+COPY_NULL = "\\N"
+
+
+class CopySource():
+    # file-like object that renders rows as CSV only as COPY reads them
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self.row_count = 0
+
+    def read(self, size=-1):
+        while size < 0 or self._buffer.tell() < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            # matches the NULL marker of the COPY statement; empty strings stay strings
+            self._writer.writerow([COPY_NULL if value is None else value for value in row])
+            self.row_count += 1
+
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    readline = read
+
+
+def copy_rows(table_name, columns: list, rows):
+    # COPY ... FROM STDIN; far cheaper than one INSERT per row for large loads
+    source = CopySource(rows)
+    query = "COPY " + table_name + " (" + ", ".join(columns) + ") FROM STDIN " + \
+        "WITH (FORMAT csv, NULL '" + COPY_NULL + "')"
+    note_write()
+
+    tx = current_transaction()
+    if tx is not None:
+        tx.flush()
+        _copy_on(tx.conn, query, source)
+        return source.row_count
+
+    with pooled_connection() as conn:
+        _copy_on(conn, query, source)
+        conn.commit()
+
+    return source.row_count
+
+
+def _copy_on(conn, query, source):
+    start = time.perf_counter()
+    try:
+        conn.cursor().copy_expert(query, source)
+    finally:
+        if _query_listeners:
+            notify_query(query, time.perf_counter() - start, source.row_count)
+
+
 def get_obj_attrs(obj):
+    # slotted models list their columns; walking dir() is the fallback for anything else
+    if hasattr(type(obj), 'column_slots'):
+        return [attr for attr in type(obj).column_slots if hasattr(obj, attr)]
+
     attrs = []
     for attr in dir(obj):
         if not callable(getattr(obj, attr)) and not attr.startswith("__"):
@@ -149,7 +759,7 @@ def get_obj_attrs(obj):
 
 
 def update_row_obj(form_obj, table_name, cond_filter: tuple):
-    cols = get_table_columns(table_name)
+    cols = get_table_columns(table_name, writable=True)
     col_values = get_col_values(cols, form_obj)
 
     # Build the SET clause for the UPDATE query
@@ -182,6 +792,14 @@ def update_row(columns: list, values: list, table_name, cond_filter: tuple, defa
     run_query(update_query, values)
 
 
+def increment_counts(table_name, col, deltas: dict):
+    # applies every id's delta in one statement instead of one UPDATE per hit
+    update_query = f"UPDATE {table_name} AS t SET {col} = t.{col} + d.delta " \
+                   f"FROM unnest(%s::int[], %s::bigint[]) AS d(id, delta) WHERE t.id = d.id;"
+
+    run_query(update_query, [list(deltas.keys()), list(deltas.values())])
+
+
 def soft_delete(table_name, cond_filter: tuple):
     update_query = f"UPDATE {table_name} SET is_deleted = %s WHERE {cond_filter[0]} = %s;"
     params = [True, cond_filter[1]]
@@ -0,0 +1,269 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool():
+    def __init__(self, connect, max_size=10, timeout=5.0, check_after=30.0):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1.")
+
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+
+        # idle connections older than this (in seconds) are pinged before reuse
+        self.check_after = check_after
+
+        self._idle = []
+        self._size = 0
+        # bumped when a connection turns out dead; idle ones from before are pinged whatever their age
+        self._generation = 0
+        self._cond = threading.Condition()
+
+        self.in_use = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.checkouts = 0
+        self.reconnects = 0
+        self.checkout_time_total = 0.0
+        self.checkout_time_max = 0.0
+
+    def _is_healthy(self, conn, idle_since, generation):
+        if conn.closed:
+            return False
+
+        # after a restart every older connection is dead, not just the first one found
+        if generation == self._generation and time.monotonic() - idle_since < self.check_after:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        with self._cond:
+            waited = False
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"No database connection free after {self.timeout}s.")
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                self._cond.wait(remaining)
+
+            if self._idle:
+                conn, idle_since, generation = self._idle.pop()
+            else:
+                # reserve the slot now, the connect itself happens outside the lock
+                conn, idle_since, generation = None, None, None
+                self._size += 1
+
+            self.in_use += 1
+
+        try:
+            if conn is not None and not self._is_healthy(conn, idle_since, generation):
+                self._discard(conn)
+                with self._cond:
+                    self.reconnects += 1
+                conn = None
+
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self.in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - start
+        with self._cond:
+            self.checkouts += 1
+            self.checkout_time_total += elapsed
+            self.checkout_time_max = max(self.checkout_time_max, elapsed)
+
+        return conn
+
+    def putconn(self, conn, discard=False, broken=False):
+        # broken: the connection failed, so the idle ones may have too
+        discard = discard or broken
+        if not discard and not conn.closed:
+            try:
+                # never hand out a connection with an open transaction
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed:
+            self._discard(conn)
+
+        with self._cond:
+            self.in_use -= 1
+            if broken:
+                self._generation += 1
+            if discard or conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic(), self._generation))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        discard = broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # the server went away; drop the connection so the next checkout reconnects
+            discard = True
+            broken = bool(conn.closed)
+            raise
+        finally:
+            # also reached when an abandoned generator is closed mid-checkout
+            self.putconn(conn, discard=discard, broken=broken)
+
+    def closeall(self):
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            avg = self.checkout_time_total / self.checkouts if self.checkouts else 0.0
+            return {
+                'size': self._size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'reconnects': self.reconnects,
+                'checkout_avg_s': avg,
+                'checkout_max_s': self.checkout_time_max,
+            }
+
+
+# seconds the replica is behind; 0 when it has replayed everything it received
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReplicaSet():
+    def __init__(self, pools, check_interval=10.0, max_lag=30.0, retry_after=30.0):
+        # round robin over the replica pools, skipping a replica that failed or fell more than
+        # max_lag seconds behind, until retry_after seconds have passed
+        if not pools:
+            raise ValueError("A replica set needs at least one pool.")
+
+        self.pools = pools
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.retry_after = retry_after
+
+        self.lag = [None] * len(pools)
+        self._down_until = [0.0] * len(pools)
+        self._checked_at = [0.0] * len(pools)
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+        self.failures = 0
+
+    def check(self, index):
+        with self.pools[index].connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(REPLICA_LAG_QUERY)
+            self.lag[index] = float(cursor.fetchone()[0])
+            conn.rollback()
+
+        return self.lag[index] <= self.max_lag
+
+    def _is_usable(self, index):
+        now = time.monotonic()
+        if now < self._down_until[index]:
+            return False
+
+        with self._lock:
+            due = now - self._checked_at[index] >= self.check_interval
+            if due:
+                self._checked_at[index] = now
+
+        # checked lazily, by the one request that finds the last check too old
+        if due:
+            try:
+                healthy = self.check(index)
+            except (psycopg2.Error, PoolTimeout):
+                healthy = False
+
+            if not healthy:
+                self._mark_down(index)
+                return False
+
+        return True
+
+    def choose(self):
+        # a pool to read from, or None when every replica is down
+        start = next(self._next)
+        for offset in range(len(self.pools)):
+            index = (start + offset) % len(self.pools)
+            if self._is_usable(index):
+                return self.pools[index]
+
+        return None
+
+    def _mark_down(self, index):
+        with self._lock:
+            self.failures += 1
+            self._down_until[index] = time.monotonic() + self.retry_after
+
+    def mark_down(self, pool):
+        self._mark_down(self.pools.index(pool))
+
+    def closeall(self):
+        for pool in self.pools:
+            pool.closeall()
+
+    def stats(self):
+        now = time.monotonic()
+        return [
+            {
+                'healthy': now >= self._down_until[index],
+                'lag_s': self.lag[index],
+                **pool.stats(),
+            }
+            for index, pool in enumerate(self.pools)
+        ]
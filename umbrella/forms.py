@@ -3,10 +3,40 @@ from flask_login import current_user
 from flask_ckeditor import CKEditorField
 from wtforms import StringField, PasswordField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
-import umbrella.db_interface as db_interface
+import umbrella.models as models
+from umbrella.taken_values import taken_values
 
 
-class RegistrationForm(FlaskForm):
+class UniqueFieldsForm(FlaskForm):
+    # unique_fields maps each field with a unique constraint on unique_table to its error;
+    # once the fields' own validators pass, all of them are probed together
+    unique_table = None
+    unique_fields = {}
+
+    def unique_values(self):
+        return {name: self[name].data for name in self.unique_fields if not self[name].errors}
+
+    def validate(self, extra_validators=None):
+        valid = super().validate(extra_validators)
+
+        for name in taken_values.find_taken(self.unique_table, self.unique_values()):
+            self[name].errors.append(self.unique_fields[name])
+            valid = False
+
+        return valid
+
+    def add_violation(self, e):
+        # the value was taken between the probe and the write; unique constraints are
+        # named <table>_<column>_key. False when the violation is not one of our fields
+        for name, message in self.unique_fields.items():
+            if e.diag.constraint_name == f"{self.unique_table}_{name}_key":
+                self[name].errors.append(message)
+                return True
+
+        return False
+
+
+class RegistrationForm(UniqueFieldsForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])
     email = StringField('Email', validators=[DataRequired(), Email()])
     password = PasswordField('Password', validators=[DataRequired()])
@@ -14,17 +44,11 @@ class RegistrationForm(FlaskForm):
     bio = StringField('Bio', validators=[Length(max=250)])
     submit = SubmitField('Sign up')
 
-    def validate_username(self, username):
-        rows = db_interface.read_rows('profile', cond=('username', username.data))
-
-        if len(rows) != 0:
-            raise ValidationError('An account with that username exists; choose a different one.')
-
-    def validate_email(self, email):
-        rows = db_interface.read_rows('profile', cond=('email', email.data))
-
-        if len(rows) != 0:
-            raise ValidationError('An account with that email exists; choose a different one.')
+    unique_table = 'profile'
+    unique_fields = {
+        'username': 'An account with that username exists; choose a different one.',
+        'email': 'An account with that email exists; choose a different one.',
+    }
 
 
 class LoginForm(FlaskForm):
@@ -36,43 +60,31 @@ class LoginForm(FlaskForm):
 
 
 
-class UpdateProfileForm(FlaskForm):
+class UpdateProfileForm(UniqueFieldsForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])
     email = StringField('Email', validators=[DataRequired(), Email()])
     bio = StringField('Bio', validators=[Length(min=2, max=250)])
     submit = SubmitField('Update')
 
-    def validate_username(self, username):
-        # if username was changed
-        if username.data != current_user.username:
-            rows = db_interface.read_rows('profile', cond=('username', username.data))
-
-            if len(rows) != 0:
-                raise ValidationError('An account with that username exists; choose a different one.')
+    unique_table = 'profile'
+    unique_fields = RegistrationForm.unique_fields
 
-    def validate_email(self, email):
-        if email.data != current_user.email:
-            rows = db_interface.read_rows('profile', cond=('email', email.data))
+    def unique_values(self):
+        # only what was changed
+        values = super().unique_values()
+        return {name: value for name, value in values.items() if value != getattr(current_user, name)}
 
-            if len(rows) != 0:
-                raise ValidationError('An account with that email exists; choose a different one.')
-
-class PostForm(FlaskForm):
+class PostForm(UniqueFieldsForm):
     title = StringField('Title', validators=[DataRequired(), Length(min=2, max=100)])
     content = CKEditorField('Content', validators=[DataRequired()])
     category = StringField('Category', validators=[DataRequired(), Length(min=2, max=100)])
     submit = SubmitField('Post')
 
-    def validate_title(self, title):
-        rows = db_interface.read_rows('post', cond=('title', title.data))
-
-        if len(rows) != 0:
-            raise ValidationError('A post with that title exists; please choose a different one.')
+    unique_table = 'post'
+    unique_fields = {'title': 'A post with that title exists; please choose a different one.'}
 
     def validate_category(self, category):
-        rows = db_interface.read_rows('category', cond=('title', category.data))
-
-        if len(rows) == 0:
+        if models.category_directory.find(category.data) is None:
             raise ValidationError('A category with that title does not exist; choose a different one.')
 
 class CommentForm(FlaskForm):
@@ -0,0 +1,262 @@
+import functools
+import logging
+import re
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+from umbrella import app
+import umbrella.db_interface as db_interface
+from umbrella.models import user_cache, category_directory
+from umbrella.page_cache import page_cache, FileBackend
+from umbrella.password_hasher import password_hasher
+from umbrella.taken_values import taken_values
+from umbrella.view_counter import post_views
+
+logger = logging.getLogger(__name__)
+
+# upper bounds, in seconds, of the statement duration histogram
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_space_re = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(statement):
+    # literals become ?, so the same statement with other values is counted once
+    statement = _literal_re.sub('?', statement)
+    statement = _list_re.sub('(?)', statement)
+    return _space_re.sub(' ', statement).strip()
+
+
+def route_name():
+    return request.url_rule.rule if request.url_rule else '<unmatched>'
+
+
+class SQLMetrics():
+    def __init__(self, slow_query_s=0.25, max_fingerprints=500):
+        # 0 turns the slow query log off
+        self.slow_query_s = slow_query_s
+        self.max_fingerprints = max_fingerprints
+
+        # fingerprint -> [statements, seconds, rows, max seconds]
+        self.statements = {}
+        # route -> [requests, request seconds, statements, statement seconds, acquire seconds, max statements]
+        self.routes = {}
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.acquires = 0
+        self.acquire_seconds = 0.0
+        self.slow_queries = 0
+        self._lock = threading.Lock()
+
+    def on_query(self, statement, seconds, rows):
+        if not isinstance(statement, str):
+            statement = str(statement)
+        key = fingerprint(statement)
+
+        slow = bool(self.slow_query_s) and seconds >= self.slow_query_s
+        bucket = 0
+        while bucket < len(BUCKETS) and seconds > BUCKETS[bucket]:
+            bucket += 1
+
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                # one series per fingerprint; a flood of distinct statements must not grow it forever
+                if len(self.statements) >= self.max_fingerprints:
+                    key = '<other>'
+                stats = self.statements.setdefault(key, [0, 0.0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += max(rows, 0)
+            stats[3] = max(stats[3], seconds)
+            self.buckets[bucket] += 1
+            self.slow_queries += slow
+
+        in_request = has_request_context() and 'sql_stats' in g
+        if in_request:
+            g.sql_stats[0] += 1
+            g.sql_stats[1] += seconds
+
+        if slow:
+            logger.warning("Slow query, %.1f ms, %s rows, on %s: %s", seconds * 1000, rows,
+                           route_name() if in_request else '<no request>', key)
+
+    def on_acquire(self, seconds):
+        with self._lock:
+            self.acquires += 1
+            self.acquire_seconds += seconds
+
+        if has_request_context() and 'sql_stats' in g:
+            g.sql_stats[2] += seconds
+
+    def begin_request(self):
+        # statements, statement seconds, acquire seconds
+        g.sql_stats = [0, 0.0, 0.0]
+        g.sql_request_start = time.perf_counter()
+
+    def end_request(self, exc=None):
+        if 'sql_stats' not in g:
+            return
+
+        queries, seconds, acquire_seconds = g.sql_stats
+        elapsed = time.perf_counter() - g.sql_request_start
+        route = route_name()
+
+        with self._lock:
+            stats = self.routes.setdefault(route, [0, 0.0, 0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += queries
+            stats[3] += seconds
+            stats[4] += acquire_seconds
+            stats[5] = max(stats[5], queries)
+
+    def install(self, app):
+        db_interface.add_query_listener(self.on_query)
+        db_interface.add_acquire_listener(self.on_acquire)
+        app.before_request(self.begin_request)
+        app.teardown_request(self.end_request)
+
+    def write(self, out):
+        with self._lock:
+            statements = {key: list(stats) for key, stats in self.statements.items()}
+            routes = {route: list(stats) for route, stats in self.routes.items()}
+            buckets = list(self.buckets)
+            acquires, acquire_seconds, slow_queries = self.acquires, self.acquire_seconds, self.slow_queries
+
+        out.counter('umbrella_sql_statements_total', 'Statements sent, by fingerprint.',
+                    [({'fingerprint': key}, stats[0]) for key, stats in statements.items()])
+        out.counter('umbrella_sql_statement_seconds_total', 'Time spent in statements, by fingerprint.',
+                    [({'fingerprint': key}, stats[1]) for key, stats in statements.items()])
+        out.counter('umbrella_sql_statement_rows_total', 'Rows returned or changed, by fingerprint.',
+                    [({'fingerprint': key}, stats[2]) for key, stats in statements.items()])
+        out.gauge('umbrella_sql_statement_max_seconds', 'Slowest run of each fingerprint.',
+                  [({'fingerprint': key}, stats[3]) for key, stats in statements.items()])
+
+        total = sum(stats[1] for stats in statements.values())
+        out.histogram('umbrella_sql_statement_duration_seconds', 'Statement durations.',
+                      BUCKETS, buckets, total)
+        out.counter('umbrella_sql_slow_statements_total', 'Statements over the slow query threshold.',
+                    [({}, slow_queries)])
+        out.counter('umbrella_db_acquires_total', 'Connections taken from the pool.', [({}, acquires)])
+        out.counter('umbrella_db_acquire_seconds_total', 'Time spent waiting for a pooled connection.',
+                    [({}, acquire_seconds)])
+
+        out.counter('umbrella_http_requests_total', 'Requests, by route.',
+                    [({'route': route}, stats[0]) for route, stats in routes.items()])
+        out.counter('umbrella_http_request_seconds_total', 'Time spent handling requests, by route.',
+                    [({'route': route}, stats[1]) for route, stats in routes.items()])
+        out.counter('umbrella_route_sql_statements_total', 'Statements sent, by route.',
+                    [({'route': route}, stats[2]) for route, stats in routes.items()])
+        out.counter('umbrella_route_sql_seconds_total', 'Time spent in statements, by route.',
+                    [({'route': route}, stats[3]) for route, stats in routes.items()])
+        out.counter('umbrella_route_db_acquire_seconds_total', 'Time spent waiting for a connection, by route.',
+                    [({'route': route}, stats[4]) for route, stats in routes.items()])
+        out.gauge('umbrella_route_sql_statements_max', 'Most statements sent by one request, by route.',
+                  [({'route': route}, stats[5]) for route, stats in routes.items()])
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusWriter():
+    # the Prometheus text exposition format, version 0.0.4
+    def __init__(self):
+        self.lines = []
+
+    def _labels(self, labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + '}'
+
+    def metric(self, kind, name, help, samples):
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            self.lines.append(f'{name}{self._labels(labels)} {float(value)!r}')
+
+    def counter(self, name, help, samples):
+        self.metric('counter', name, help, samples)
+
+    def gauge(self, name, help, samples):
+        self.metric('gauge', name, help, samples)
+
+    def histogram(self, name, help, bounds, counts, total):
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} histogram')
+        cumulative = 0
+        for bound, count in zip(list(bounds) + ['+Inf'], counts):
+            cumulative += count
+            self.lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        self.lines.append(f'{name}_sum {total!r}')
+        self.lines.append(f'{name}_count {cumulative}')
+
+    def stats(self, prefix, help, stats):
+        # one gauge per numeric field of a stats() dict
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                self.gauge(f'{prefix}_{key}', f'{help} {key}.', [({}, value)])
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def render_metrics():
+    out = PrometheusWriter()
+    if sql_metrics is not None:
+        sql_metrics.write(out)
+
+    out.stats('umbrella_db_pool', 'Connection pool', db_interface.pool_stats())
+
+    replicas = db_interface.replica_stats()
+    if replicas:
+        out.gauge('umbrella_db_replica_healthy', 'Whether reads are sent to the replica.',
+                  [({'replica': i}, stats['healthy']) for i, stats in enumerate(replicas)])
+        out.gauge('umbrella_db_replica_lag_seconds', 'Replication lag at the last health check.',
+                  [({'replica': i}, stats['lag_s']) for i, stats in enumerate(replicas) if stats['lag_s'] is not None])
+        out.gauge('umbrella_db_replica_in_use', 'Replica connections checked out.',
+                  [({'replica': i}, stats['in_use']) for i, stats in enumerate(replicas)])
+        out.counter('umbrella_db_replica_checkouts_total', 'Replica connections taken from the pool.',
+                    [({'replica': i}, stats['checkouts']) for i, stats in enumerate(replicas)])
+    out.stats('umbrella_user_cache', 'User cache', user_cache.stats())
+    out.stats('umbrella_post_views', 'Buffered view counter', post_views.stats())
+    out.stats('umbrella_password_hasher', 'Password hashing pool', password_hasher.stats())
+    out.stats('umbrella_taken_values', 'Uniqueness probe', taken_values.stats())
+    out.stats('umbrella_category_directory', 'Category directory', category_directory.stats())
+    out.counter('umbrella_page_cache_hits_total', 'Fragment cache hits.', [({}, page_cache.hits)])
+    out.counter('umbrella_page_cache_misses_total', 'Fragment cache misses.', [({}, page_cache.misses)])
+
+    # per fragment key, for the most recently used keys only (FragmentCache.max_tracked_keys)
+    keys = page_cache.stats()
+    out.counter('umbrella_page_cache_key_hits_total', 'Fragment cache hits, by key.',
+                [({'key': key}, stats['hits']) for key, stats in keys.items()])
+    out.counter('umbrella_page_cache_key_misses_total', 'Fragment cache misses, by key.',
+                [({'key': key}, stats['misses']) for key, stats in keys.items()])
+    out.gauge('umbrella_page_cache_key_hit_ratio', 'Fragment cache hit ratio, by key.',
+              [({'key': key}, stats['hit_ratio']) for key, stats in keys.items()])
+    out.gauge('umbrella_page_cache_key_render_seconds', 'Last render time of the fragment, by key.',
+              [({'key': key}, stats['render_s']) for key, stats in keys.items()])
+    out.counter('umbrella_page_cache_key_saved_seconds_total', 'Render time saved by cache hits, by key.',
+                [({'key': key}, stats['saved_s']) for key, stats in keys.items()])
+    if isinstance(page_cache.backend, FileBackend):
+        out.counter('umbrella_page_cache_swept_files_total', 'Expired or excess cache files removed.',
+                    [({}, page_cache.backend.swept)])
+
+    return out.render()
+
+
+def create_sql_metrics(config):
+    if not config['SQL_METRICS']:
+        return None
+
+    metrics = SQLMetrics(slow_query_s=config['SLOW_QUERY_MS'] / 1000)
+    metrics.install(app)
+    return metrics
+
+
+sql_metrics = create_sql_metrics(app.config)
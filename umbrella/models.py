@@ -1,30 +1,251 @@
+import base64
+import binascii
+import json
 import math
+import os
 import umbrella.db_interface as db_interface
-from umbrella import login_manager
-from flask_login import UserMixin
+import umbrella.async_db_interface as async_db_interface
+from umbrella import app, login_manager
+from umbrella.cache import TTLCache
+from umbrella.category_directory import CategoryDirectory
+from flask import g, has_request_context
 import datetime
 
 
-class DBModel():
+def encode_cursor(created_at, id):
+    key = json.dumps([created_at.isoformat(), id])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.datetime.fromisoformat(created_at), int(id)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError("Invalid feed cursor.")
+
+
+class ModelMeta(type):
+    # a slot per db_columns entry plus extra_slots, so model objects carry no per-instance dict
+    def __new__(mcs, name, bases, namespace):
+        if '__slots__' not in namespace:
+            inherited = {slot for base in bases for cls in base.__mro__ for slot in getattr(cls, '__slots__', ())}
+            columns = tuple(col[0].strip('"') for col in namespace.get('db_columns', ()))
+            slots = columns + tuple(namespace.get('extra_slots', ()))
+
+            namespace['column_slots'] = columns
+            namespace['__slots__'] = tuple(slot for slot in slots if slot not in inherited)
+
+        return super().__new__(mcs, name, bases, namespace)
+
+
+# (model, column names) -> compiled row mapper
+_row_mappers = {}
+
+
+class DBModel(metaclass=ModelMeta):
+    __slots__ = ()
+
     table_name = ""
-    is_deleted = False
-    id = 0
+    column_slots = ()
+
+    # set on every new object, unless the row being mapped has the column
+    slot_defaults = {'id': 0, 'is_deleted': False}
+
+    # (name, method, column list or expression, *modifiers such as a WHERE clause)
+    db_indexes = []
+
+    # counters bumped in the background; updating only these leaves updated_at alone,
+    # so they do not change the versions behind the ETags
+    counter_columns = []
+
+    def __new__(cls, *args, **kwargs):
+        obj = super().__new__(cls)
+        for name, value in cls.slot_defaults.items():
+            setattr(obj, name, value)
+        return obj
 
     def set_id(self, new_id):
         if not isinstance(new_id, int):
             raise ValueError("id param not an int.")
         self.id = new_id
 
+    @classmethod
+    def row_defaults(cls, columns):
+        return {name: value for name, value in cls.slot_defaults.items() if name not in columns}
+
+    @classmethod
+    def row_factory(cls, columns):
+        # for db_interface's MappingCursor: one compiled mapper per model and column list
+        build = _row_mappers.get((cls, columns))
+        if build is None:
+            build = _row_mappers[(cls, columns)] = cls._compile_mapper(columns)
+        return build
+
+    @classmethod
+    def _compile_mapper(cls, columns):
+        # a row is unpacked straight into the slots, by column name; unknown columns are skipped.
+        # generated rather than a zip/setattr loop: the build is one tuple unpack into slot
+        # stores, with no per-column call or loop step, about 3x faster per row on CPython
+        slots = set(cls.column_slots)
+        targets = [f"obj.{col}" if col in slots else "_" for col in columns]
+        defaults = cls.row_defaults(columns)
+
+        lines = ["def build(row):", "    obj = new(cls)", "    " + ", ".join(targets) + ", = row"]
+        lines += [f"    obj.{name} = defaults[{name!r}]" for name in defaults]
+        lines.append("    return obj")
+
+        namespace = {'new': object.__new__, 'cls': cls, 'defaults': defaults}
+        exec("\n".join(lines), namespace)
+        return namespace['build']
+
+
+def identity_map():
+    # (table name, id) -> model object, for the lifetime of one request only
+    if not has_request_context():
+        return None
+
+    if 'identity_map' not in g:
+        g.identity_map = {}
+    return g.identity_map
+
+
+@app.teardown_request
+def clear_identity_map(exc):
+    g.pop('identity_map', None)
+
+
+def add_identity(obj):
+    # the first object loaded for a row wins, so every lookup resolves to the same one
+    id_map = identity_map()
+    if id_map is None:
+        return obj
+    return id_map.setdefault((obj.table_name, obj.id), obj)
+
+
+def get_identity(model, id):
+    id_map = identity_map()
+    if id_map is None:
+        return None
+    return id_map.get((model.table_name, id))
+
+
+def get_identities(model, ids):
+    found = {}
+    missing = []
+    for id in set(ids):
+        obj = get_identity(model, id)
+        if obj is None:
+            missing.append(id)
+        else:
+            found[id] = obj
+
+    return found, missing
+
+
+def get_id_filter_identity(model, row_filter):
+    # a lookup by id that the identity map can answer without a query
+    if row_filter and row_filter[0] == 'id':
+        try:
+            return get_identity(model, int(row_filter[1]))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def get_feed_version():
+    # new posts raise max(id); edits, deletes and renames move an updated_at. view flushes do not,
+    # since no listing shows view counts
+    query = \
+        """
+        SELECT
+            (SELECT max(id) FROM post),
+            (SELECT max(updated_at) FROM post),
+            (SELECT max(updated_at) FROM profile),
+            (SELECT max(updated_at) FROM category);
+        """
+
+    row = db_interface.run_query(query)[0]
+    return row, max((ts for ts in row[1:] if ts), default=None)
+
+
+def get_post_version(post_id):
+    # the page shows the view count, which its flushes no longer reflect in updated_at
+    query = \
+        """
+        SELECT
+            p.updated_at, pu.updated_at, count(c.id), max(c.created_at), max(cu.updated_at), p.view_count
+        FROM
+            post p
+            JOIN profile pu ON pu.id = p.author_id
+            LEFT JOIN comment c ON c.post_id = p.id AND c.is_deleted = False
+            LEFT JOIN profile cu ON cu.id = c.author_id
+        WHERE
+            p.id = %s AND p.is_deleted = False
+        GROUP BY
+            p.id, pu.id;
+        """
+
+    rows = db_interface.run_query(query, [post_id])
+    if not rows:
+        return None
+
+    row = rows[0]
+    timestamps = [row[0], row[1], row[3], row[4]]
+    return row, max(ts for ts in timestamps if ts)
+
+
+def get_profile_version(profile_id):
+    rows = db_interface.run_query(
+        "SELECT updated_at FROM profile WHERE id = %s AND is_deleted = False;", [profile_id]
+    )
+    if not rows:
+        return None
+
+    return rows[0], rows[0][0]
+
+
+def db_models():
+    # in creation order, referenced tables first
+    return [User, Category, Post, Comment]
+
+
+def check_model_columns():
+    # fills the column cache for every model table in one query and reports drift
+    # between the db_columns declarations and the live schema
+    models = db_models()
+    db_interface.load_table_columns([m.table_name for m in models])
+
+    mismatches = {}
+    for m in models:
+        missing, undeclared = db_interface.check_table_columns(m.table_name, m.db_columns)
+        if missing or undeclared:
+            mismatches[m.table_name] = (missing, undeclared)
+
+    return mismatches
+
+
+# users loaded for flask_login, by id; a write to a profile must pop its entry
+user_cache = TTLCache(
+    maxsize=int(os.getenv('UMBRELLA_USER_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('UMBRELLA_USER_CACHE_TTL', 60)),
+)
+
 
 @login_manager.user_loader
 def load_user(user_id):
+    user = user_cache.get(int(user_id))
+    if user is not None:
+        return add_identity(user)
+
     users = User().query_users(('id', user_id))
     if len(users) != 0:
+        user_cache.set(users[0].id, users[0])
         return users[0]
     return None
 
 
-class User(DBModel, UserMixin):
+class User(DBModel):
     db_columns = [
         ("id", "serial", "PRIMARY KEY"),
         ("username", "varchar(255)", "UNIQUE NOT NULL"),
@@ -33,6 +254,11 @@ class User(DBModel, UserMixin):
         ("bio", "varchar(511)"),
         ("created_at", "timestamp", "DEFAULT current_timestamp NOT NULL"),
         ("is_deleted", "boolean"),
+        ("updated_at", "timestamp", "DEFAULT current_timestamp NOT NULL"),
+    ]
+
+    db_indexes = [
+        ("profile_updated_at_idx", "btree", "updated_at"),
     ]
 
     table_name = "profile"
@@ -43,25 +269,79 @@ class User(DBModel, UserMixin):
         self.email = email
         self.bio = bio
         self.created_at = datetime.datetime.now()
+        self.updated_at = self.created_at
 
     def __str__(self):
         return self.username.get_content() + ' User'
 
+    # what flask_login expects of a user; not inherited from UserMixin, which has no
+    # __slots__ and so would give every User a __dict__ again
+    __hash__ = object.__hash__
+
+    @property
+    def is_active(self):
+        return True
+
+    @property
+    def is_authenticated(self):
+        return self.is_active
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return NotImplemented
+        return not equal
+
     def query_users(self, user_filter=None):
+        known = get_id_filter_identity(self, user_filter)
+        if known is not None:
+            return [known]
+
         if user_filter:
-            rows = db_interface.read_rows('profile', cond=user_filter)
+            users = db_interface.read_rows('profile', cond=user_filter, row_factory=User.row_factory)
         else:
-            rows = db_interface.read_rows('profile')
+            users = db_interface.read_rows('profile', row_factory=User.row_factory)
+
+        return [add_identity(user) for user in users]
+
+    def update_password(self, pw_hash):
+        db_interface.update_row(['password'], [pw_hash], self.table_name, ('id', self.id))
+        self.password = pw_hash
+        user_cache.pop(self.id)
+
+    def stream_users(self, user_filter=None, batch_size=500):
+        # streamed users stay out of the identity map so memory stays bounded
+        for users in db_interface.stream_rows(self.table_name, cond=user_filter, batch_size=batch_size,
+                                              row_factory=User.row_factory):
+            yield from users
 
-        users = []
-        for r in rows:
-            id, username, email, password, bio, join_date, _ = r
+    def query_users_by_id(self, ids, register=True):
+        # register=False reads the identity map but adds nothing to it, for streamed rows
+        users, missing = get_identities(self, ids)
 
-            user = User(username, password, email, bio)
-            user.created_at = join_date
-            user.set_id(id)
+        for user in db_interface.read_rows_in(self.table_name, 'id', missing, row_factory=User.row_factory):
+            users[user.id] = add_identity(user) if register else user
 
-            users.append(user)
+        return users
+
+    async def query_users_by_id_async(self, ids):
+        users, missing = get_identities(self, ids)
+
+        for user in await async_db_interface.read_rows_in(self.table_name, 'id', missing,
+                                                          row_factory=User.row_factory):
+            users[user.id] = add_identity(user)
 
         return users
 
@@ -76,9 +356,28 @@ class Post(DBModel):
         ("author_id", "int", "REFERENCES profile(id)"),
         ("category_id", "int", "REFERENCES category(id)"),
         ("is_deleted", "boolean"),
+        ("search_vector", "tsvector", "GENERATED ALWAYS AS (to_tsvector('english', "
+                                      "coalesce(title, '') || ' ' || coalesce(\"content\", ''))) STORED"),
+        ("updated_at", "timestamp", "DEFAULT current_timestamp NOT NULL"),
+    ]
+
+    db_indexes = [
+        ("post_feed_idx", "btree", "created_at DESC, id DESC", "WHERE is_deleted = False"),
+        ("post_category_feed_idx", "btree", "category_id, created_at DESC, id DESC", "WHERE is_deleted = False"),
+        ("post_author_id_idx", "btree", "author_id"),
+        ("post_search_vector_idx", "gin", "search_vector", "WHERE is_deleted = False"),
+        ("post_updated_at_idx", "btree", "updated_at"),
     ]
 
     table_name = "post"
+    counter_columns = ["view_count"]
+
+    # what listings show; anything else is deferred and fetched on first access
+    listing_columns = ["id", "title", "created_at", "view_count", "author_id", "category_id"]
+    deferrable_columns = ["content"]
+
+    extra_slots = ("author", "category", "_deferred")
+    slot_defaults = {**DBModel.slot_defaults, 'author': None, 'category': None, '_deferred': frozenset()}
 
     def __init__(self, title=None, content=None, view_count=None, author=None, category=None):
         self.title = title
@@ -89,65 +388,125 @@ class Post(DBModel):
         self.author_id = 0
         self.category_id = 0
         self.created_at = datetime.datetime.now()
+        self.updated_at = self.created_at
 
     def __str__(self):
         return self.title
 
-    def _populate_post(self, row):
-        id, title, content, created_at, view_count, author_id, category_id, _ = row
+    def __getattr__(self, name):
+        # only reached for slots that were never set, i.e. deferred columns
+        if name == '_deferred' or name not in self._deferred:
+            raise AttributeError(f"'Post' object has no attribute '{name}'")
+
+        self._load_deferred()
+        return getattr(self, name)
+
+    @classmethod
+    def row_defaults(cls, columns):
+        defaults = super().row_defaults(columns)
+        defaults['_deferred'] = frozenset(col for col in cls.deferrable_columns if col not in columns)
+        return defaults
+
+    def _load_deferred(self):
+        columns = sorted(self._deferred)
+        row = db_interface.read_rows(self.table_name, cond=('id', self.id), columns=columns)[0]
+
+        for col, value in zip(columns, row):
+            setattr(self, col, value)
+        self._deferred = set()
+
+    def _populate_post(self, post, users, cats, register=True):
+        # the row mapper filled the columns; this adds the author and category objects
+        post.author = users.get(post.author_id)
+        post.category = cats.get(post.category_id)
 
-        user = User().query_users(('id', author_id))[0]
-        cat = Category().query_categories(('id', category_id))[0]
+        return add_identity(post) if register else post
 
-        post = Post(title, content, view_count, user, cat)
-        post.created_at = created_at
-        post.set_id(id)
+    def _populate_posts(self, posts, register=True):
+        # authors and categories are loaded in one batch each, whatever the number of posts
+        users = User().query_users_by_id((post.author_id for post in posts), register)
+        cats = Category().query_categories_by_id(post.category_id for post in posts)
 
-        post.author_id = author_id
-        post.category_id = category_id
+        return [self._populate_post(post, users, cats, register) for post in posts]
 
-        return post
+    async def _populate_posts_async(self, posts, register=True):
+        users = await User().query_users_by_id_async(post.author_id for post in posts)
+        cats = Category().query_categories_by_id(post.category_id for post in posts)
 
-    def _get_posts(self, limit, post_filter=None, use_like=False):
+        return [self._populate_post(post, users, cats, register) for post in posts]
+
+    def stream_posts(self, post_filter=None, use_like=False, batch_size=500, columns=None):
+        # authors and categories are batch loaded per chunk of rows, on the stream's own connection;
+        # none of it enters the identity map, so memory stays bounded by the chunk
+        for posts in db_interface.stream_rows(self.table_name, cond=post_filter, use_like=use_like,
+                                              batch_size=batch_size, columns=columns, row_factory=Post.row_factory):
+            yield from self._populate_posts(posts, register=False)
+
+    def _get_posts(self, limit, post_filter=None, use_like=False, columns=None):
         if post_filter:
-            if use_like:
-                rows = db_interface.read_rows(self.table_name, cond=post_filter, limit=limit, use_like=True)
-                posts = []
+            posts = db_interface.read_rows(self.table_name, cond=post_filter, limit=limit, use_like=use_like,
+                                           columns=columns, row_factory=Post.row_factory)
+        else:
+            posts = db_interface.read_rows(self.table_name, limit=limit, columns=columns,
+                                           row_factory=Post.row_factory)
 
-                for r in rows:
-                    post = self._populate_post(r)
-                    posts.append(post)
+        return self._populate_posts(posts)
 
-                return posts
+    def query_feed(self, category_id=None, cursor=None, limit=20):
+        # newest first; returns the page and the cursor of the next one, if there is one
+        after = decode_cursor(cursor) if cursor else None
+        cond = ('category_id', category_id) if category_id else None
 
-            rows = db_interface.read_rows(self.table_name, cond=post_filter, limit=limit)
-            posts = []
+        rows = db_interface.read_rows_after(self.table_name, ['created_at', 'id'], after=after,
+                                            limit=limit + 1, cond=cond, columns=self.listing_columns,
+                                            row_factory=Post.row_factory)
+        posts = self._populate_posts(rows[:limit])
 
-            for r in rows:
-                post = self._populate_post(r)
-                posts.append(post)
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(posts[-1].created_at, posts[-1].id)
 
-            return posts
+        return posts, next_cursor
 
-        rows = db_interface.read_rows(self.table_name, limit=limit)
-        posts = []
+    def search_posts(self, text, limit=20, offset=None):
+        # only the requested page is fetched and hydrated, without the post bodies
+        posts = db_interface.search_rows(self.table_name, text, limit=limit, offset=offset,
+                                         columns=self.listing_columns, row_factory=Post.row_factory)
+        return self._populate_posts(posts)
 
-        for r in rows:
-            post = self._populate_post(r)
-            posts.append(post)
+    def count_search(self, text, max_count=None):
+        return db_interface.count_search_rows(self.table_name, text, max_count=max_count)
 
-        return posts
+    async def search_posts_async(self, text, limit=20, offset=None):
+        posts = await async_db_interface.search_rows(self.table_name, text, limit=limit, offset=offset,
+                                                     columns=self.listing_columns, row_factory=Post.row_factory)
+        return await self._populate_posts_async(posts)
+
+    async def count_search_async(self, text, max_count=None):
+        return await async_db_interface.count_search_rows(self.table_name, text, max_count=max_count)
+
+    def search_page(self, text, limit=20, offset=None, max_count=None):
+        # the page and the capped count do not depend on each other
+        if async_db_interface.is_enabled():
+            return async_db_interface.run_concurrently(self.search_posts_async(text, limit, offset),
+                                                       self.count_search_async(text, max_count))
+
+        return self.search_posts(text, limit, offset), self.count_search(text, max_count)
+
+    def query_posts(self, post_filter=None, limit=20, use_like=False, columns=None):
+        known = None if use_like else get_id_filter_identity(self, post_filter)
+        if known is not None:
+            return [known]
 
-    def query_posts(self, post_filter=None, limit=20, use_like=False):
         if post_filter:
             if use_like:
-                posts = self._get_posts(limit, post_filter, use_like=True)
+                posts = self._get_posts(limit, post_filter, use_like=True, columns=columns)
                 return posts
 
-            posts = self._get_posts(limit, post_filter)
+            posts = self._get_posts(limit, post_filter, columns=columns)
             return posts
 
-        posts = self._get_posts(limit)
+        posts = self._get_posts(limit, columns=columns)
         return posts
 
 
@@ -199,8 +558,16 @@ class Comment(DBModel):
         ("is_deleted", "boolean"),
     ]
 
+    db_indexes = [
+        ("comment_post_id_idx", "btree", "post_id, created_at", "WHERE is_deleted = False"),
+        ("comment_author_id_idx", "btree", "author_id"),
+    ]
+
     table_name = "comment"
 
+    extra_slots = ("author",)
+    slot_defaults = {**DBModel.slot_defaults, 'author': None}
+
     def __init__(self, content=None, author=None, post_id=None):
         self.content = content
         self.created_at = datetime.datetime.now()
@@ -214,34 +581,59 @@ class Comment(DBModel):
     def set_date(self, date):
         self.created_at = datetime.datetime.date(date)
 
+    def _populate_comments(self, coms, users=None, register=True):
+        if users is None:
+            users = User().query_users_by_id((com.author_id for com in coms), register)
+
+        for com in coms:
+            com.author = users.get(com.author_id)
+
+        return coms
+
     def query_comments(self, comment_filter=None):
         if comment_filter:
-            rows = db_interface.read_rows(self.table_name, cond=comment_filter)
+            coms = db_interface.read_rows(self.table_name, cond=comment_filter, row_factory=Comment.row_factory)
         else:
-            rows = db_interface.read_rows(self.table_name)
-
-        coms = []
-        for r in rows:
-            id, content, created_at, author_id, post_id, _ = r
-
-            author = User().query_users(('id', author_id))[0]
-            com = Comment(content, author, post_id)
-            com.created_at = created_at
-            com.id = id
-            com.author_id = author_id
+            coms = db_interface.read_rows(self.table_name, row_factory=Comment.row_factory)
 
-            coms.append(com)
+        return self._populate_comments(coms)
 
-        return coms
+    def stream_comments(self, comment_filter=None, batch_size=500):
+        for coms in db_interface.stream_rows(self.table_name, cond=comment_filter, batch_size=batch_size,
+                                             row_factory=Comment.row_factory):
+            yield from self._populate_comments(coms, register=False)
 
 
 class PostComment():
-    def __init__(self, post_id):
-        self.post = Post().query_posts(('id', post_id))[0]
-        self.comments = self._query_post_comments()
-
-    def _query_post_comments(self):
-        return Comment().query_comments(('post_id', self.post.id))
+    def __init__(self, post_id, rows=None):
+        # rows, when given, are the already fetched (posts, comments)
+        posts, coms = rows or (
+            db_interface.read_rows(Post.table_name, cond=('id', post_id), row_factory=Post.row_factory),
+            db_interface.read_rows(Comment.table_name, cond=('post_id', post_id), row_factory=Comment.row_factory),
+        )
+        post = posts[0]
+
+        # the post author and every distinct commenter are loaded together
+        author_ids = {post.author_id}
+        author_ids.update(com.author_id for com in coms)
+        users = User().query_users_by_id(author_ids)
+        cats = Category().query_categories_by_id([post.category_id])
+
+        self.post = Post()._populate_post(post, users, cats)
+        self.comments = Comment()._populate_comments(coms, users)
+
+    @classmethod
+    def load(cls, post_id):
+        if not async_db_interface.is_enabled():
+            return cls(post_id)
+
+        # the post and its comments are fetched at the same time
+        rows = async_db_interface.run_concurrently(
+            async_db_interface.read_rows(Post.table_name, cond=('id', post_id), row_factory=Post.row_factory),
+            async_db_interface.read_rows(Comment.table_name, cond=('post_id', post_id),
+                                         row_factory=Comment.row_factory),
+        )
+        return cls(post_id, rows)
 
 
 class Category(DBModel):
@@ -251,38 +643,52 @@ class Category(DBModel):
         ("description", "varchar(255)"),
         ("post_count", "bigserial", "NOT NULL"),
         ("is_deleted", "boolean"),
+        ("updated_at", "timestamp", "DEFAULT current_timestamp NOT NULL"),
     ]
 
     table_name = "category"
+    counter_columns = ["post_count"]
 
     def __init__(self, title=None, description=None, post_count=None):
         self.id = 0
         self.title = title
         self.description = description
         self.post_count = post_count
+        self.updated_at = datetime.datetime.now()
 
     def __str__(self):
         return self.title
 
-    def query_categories(self, ind_cat_filter=None):
-        if ind_cat_filter:
-            rows = db_interface.read_rows(self.table_name, cond=ind_cat_filter)
+    def load_categories(self):
+        # straight from the table, on the primary: a reload follows a change that a lagging
+        # replica may not have yet, and the directory would keep the old rows until the next one
+        return db_interface.run_query("SELECT * FROM " + self.table_name + " WHERE is_deleted = False",
+                                      row_factory=Category.row_factory)
 
-            id, title, desc, post_count, _ = rows[0]
+    def query_categories_by_id(self, ids):
+        cats = {}
+        for id in set(ids):
+            cat = category_directory.get(id)
+            if cat is not None:
+                cats[id] = cat
 
-            cat = Category(title, desc, post_count)
-            cat.set_id(id)
+        return cats
 
-            return [cat]
+    def query_categories(self, ind_cat_filter=None):
+        if ind_cat_filter:
+            field, value = ind_cat_filter
+            if field == 'id':
+                cat = category_directory.get(int(value))
+            elif field == 'title':
+                cat = category_directory.find(value)
+            else:
+                cats = db_interface.read_rows(self.table_name, cond=ind_cat_filter, row_factory=Category.row_factory)
+                return [cats[0]]
 
-        rows = db_interface.read_rows(self.table_name)
-        cats = []
-        for r in rows:
-            id, title, desc, post_count, _ = r
+            return [cat] if cat else []
 
-            cat = Category(title, desc, post_count)
-            cat.set_id(id)
+        return category_directory.all()
 
-            cats.append(cat)
 
-        return cats
+# every live category by id and title, refreshed by NOTIFY from the category table
+category_directory = CategoryDirectory(lambda: Category().load_categories())
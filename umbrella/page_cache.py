@@ -0,0 +1,283 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import g, request
+from flask_login import current_user
+
+from umbrella import app
+from umbrella.cache import TTLCache
+
+
+class MemoryBackend():
+    def __init__(self, maxsize=512, ttl=30.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        # bumping a namespace's generation orphans its entries; the LRU drops them later.
+        # clear() bumps the epoch, so generations can start over without reusing a key
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def token(self, namespace):
+        with self._lock:
+            return self._epoch, self._generations.get(namespace, 0)
+
+    def get(self, namespace, key):
+        return self._cache.get((namespace, self.token(namespace), key))
+
+    def set(self, namespace, key, value, token):
+        # stored under the generation the render started in; if it was invalidated
+        # meanwhile, the entry is orphaned rather than served
+        self._cache.set((namespace, token, key), value)
+
+    def invalidate(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._generations.clear()
+        self._cache.clear()
+
+
+# file times can lag time.time() by a clock tick; a render this close to an invalidation is not stored
+MTIME_SLACK = 0.05
+
+
+class FileBackend():
+    # shared by every worker on the host, so an invalidation reaches all of them
+    def __init__(self, directory, ttl=30.0, max_files=512):
+        self.directory = directory
+        self.ttl = ttl
+
+        # keys include the query string, so files are swept: expired ones go, and past
+        # max_files the oldest go too; checked every ttl seconds or max_files / 10 writes
+        self.max_files = max_files
+        self._writes = 0
+        self._last_sweep = time.monotonic()
+        self._sweep_lock = threading.Lock()
+        self.swept = 0
+
+    def _dir(self, namespace):
+        return os.path.join(self.directory, namespace.replace(os.sep, '_'))
+
+    def _path(self, namespace, key):
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self._dir(namespace), name + '.json')
+
+    def _marker(self, namespace):
+        # touched on every invalidation, so a worker can tell one happened after its render began
+        return self._dir(namespace) + '.invalidated'
+
+    def _markers(self, namespace):
+        return self._marker(namespace), os.path.join(self.directory, '.cleared')
+
+    def _invalidated_since(self, namespace, since):
+        for marker in self._markers(namespace):
+            try:
+                if os.path.getmtime(marker) >= since - MTIME_SLACK:
+                    return True
+            except OSError:
+                pass
+        return False
+
+    def _touch(self, path):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+
+    def token(self, namespace):
+        return time.time()
+
+    def get(self, namespace, key):
+        path = self._path(namespace, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, namespace, key, value, token):
+        if self._invalidated_since(namespace, token):
+            return
+
+        path = self._path(namespace, key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            # an invalidation moved the directory away mid-write; the page is rendered already,
+            # so it is just not cached this time
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+        self._writes += 1
+        if self._writes >= max(self.max_files // 10, 1) or time.monotonic() - self._last_sweep >= self.ttl:
+            self.sweep()
+
+    def sweep(self):
+        # one sweep at a time per process; other processes sweeping too is harmless
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._writes, self._last_sweep = 0, time.monotonic()
+            now = time.time()
+
+            files = []
+            for dirpath, _, names in os.walk(self.directory):
+                for name in names:
+                    if not name.endswith(('.json', '.tmp')):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        files.append((os.path.getmtime(path), path))
+                    except OSError:
+                        pass
+
+            files.sort()
+            excess = len(files) - self.max_files
+            for n, (mtime, path) in enumerate(files):
+                if n >= excess and now - mtime <= self.ttl:
+                    break
+                try:
+                    os.remove(path)
+                    self.swept += 1
+                except OSError:
+                    pass
+        finally:
+            self._sweep_lock.release()
+
+    def _remove(self, path):
+        # renamed first so that no reader sees a half deleted directory
+        trash = f"{path}.{uuid.uuid4().hex}.old"
+        try:
+            os.rename(path, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def invalidate(self, namespace):
+        self._touch(self._marker(namespace))
+        self._remove(self._dir(namespace))
+
+    def clear(self):
+        self._touch(os.path.join(self.directory, '.cleared'))
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                self._remove(path)
+
+
+class FragmentCache():
+    def __init__(self, backend, max_tracked_keys=1000):
+        self.backend = backend
+        self.max_tracked_keys = max_tracked_keys
+
+        # (namespace, key) -> [hits, misses, last render seconds, render seconds saved]
+        self._key_stats = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _track(self, namespace, key, hit, render_time=None):
+        with self._lock:
+            stats = self._key_stats.get((namespace, key))
+            if stats is None:
+                stats = self._key_stats[(namespace, key)] = [0, 0, 0.0, 0.0]
+                if len(self._key_stats) > self.max_tracked_keys:
+                    self._key_stats.popitem(last=False)
+
+            if hit:
+                self.hits += 1
+                stats[0] += 1
+                stats[3] += stats[2]
+            else:
+                self.misses += 1
+                stats[1] += 1
+                stats[2] = render_time
+
+    def fragment(self, namespace, render, key=None):
+        # render returns a str or a dict of str, and must do all the querying the fragment needs
+        if self.backend is None:
+            return render()
+
+        key = key or request_key()
+        # taken before rendering: an invalidation during the render must win over its result
+        token = self.backend.token(namespace)
+        value = self.backend.get(namespace, key)
+        if value is not None:
+            self._track(namespace, key, True)
+            return value
+
+        start = time.perf_counter()
+        value = render()
+        self._track(namespace, key, False, time.perf_counter() - start)
+
+        self.backend.set(namespace, key, value, token)
+        return value
+
+    def invalidate(self, *namespaces):
+        if self.backend is not None:
+            for namespace in namespaces:
+                self.backend.invalidate(namespace)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            keys = {}
+            for (namespace, key), (hits, misses, render_time, saved) in self._key_stats.items():
+                keys[f"{namespace} {key}"] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': hits / (hits + misses),
+                    'render_s': render_time,
+                    'saved_s': saved,
+                }
+            return keys
+
+
+def request_key():
+    # route, its arguments, the query string, who is looking and, on conditional routes,
+    # the version of the data the ETag was computed from
+    auth = f"user:{current_user.id}" if current_user.is_authenticated else "anon"
+    view_args = sorted((request.view_args or {}).items())
+    return json.dumps([request.endpoint, view_args, sorted(request.args.items(multi=True)), auth,
+                       g.get('page_version')])
+
+
+def create_page_cache(config):
+    backend_name = config['PAGE_CACHE_BACKEND']
+    ttl = config['PAGE_CACHE_TTL']
+
+    if backend_name == 'memory':
+        backend = MemoryBackend(maxsize=config['PAGE_CACHE_SIZE'], ttl=ttl)
+    elif backend_name == 'filesystem':
+        backend = FileBackend(config['PAGE_CACHE_DIR'], ttl=ttl, max_files=config['PAGE_CACHE_SIZE'])
+    elif backend_name == 'none':
+        backend = None
+    else:
+        raise ValueError(f"Unknown PAGE_CACHE_BACKEND {backend_name!r}.")
+
+    return FragmentCache(backend)
+
+
+page_cache = create_page_cache(app.config)
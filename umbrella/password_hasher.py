@@ -0,0 +1,207 @@
+import atexit
+import concurrent.futures
+import hashlib
+import hmac
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+import bcrypt
+
+from umbrella import app
+
+_cost_re = re.compile(r"^\$2[abxy]?\$(\d\d)\$")
+
+
+class HasherBusy(Exception):
+    pass
+
+
+# these run in the pool's processes; each also returns when it started, to measure time spent queued
+def _hash(password, rounds, prefix):
+    started = time.time()
+    pw_hash = bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds, prefix=prefix))
+    return pw_hash.decode('utf-8'), started
+
+
+def _check(pw_hash, password):
+    started = time.time()
+    return hmac.compare_digest(bcrypt.hashpw(password, pw_hash), pw_hash), started
+
+
+def get_rounds(pw_hash):
+    # the cost is stored in the hash itself: $2b$12$...
+    match = _cost_re.match(pw_hash)
+    return int(match.group(1)) if match else None
+
+
+class PasswordHasher():
+    def __init__(self, rounds=12, prefix='2b', handle_long_passwords=False, workers=2, max_pending=8,
+                 queue_timeout=5.0, timeout=30.0):
+        # workers=0 hashes in the calling thread, still under the max_pending cap
+        self.rounds = rounds
+        self.prefix = prefix
+        self.handle_long_passwords = handle_long_passwords
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.queue_s = 0.0
+        self.max_queue_s = 0.0
+        self.hash_s = 0.0
+
+    def _get_executor(self):
+        # a forked web worker cannot use its parent's pool, so each process starts its own
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    # never fork: by now the app has threads (view counter, LISTEN, asyncpg loop), and a
+                    # lock one of them held at fork time would stay held in the child forever.
+                    # a forkserver is started fresh and imports this module once, before any thread
+                    if 'forkserver' in multiprocessing.get_all_start_methods():
+                        context = multiprocessing.get_context('forkserver')
+                        context.set_forkserver_preload([__name__])
+                    else:
+                        context = multiprocessing.get_context('spawn')
+                    self._executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+                    self._executor_pid = os.getpid()
+
+        return self._executor
+
+    def _run(self, fn, *args):
+        queued = time.time()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy(f"{self.max_pending} password hashes already pending.")
+
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+
+        if not self.workers:
+            try:
+                result, started = fn(*args)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                self._release()
+        else:
+            executor = future = None
+            try:
+                executor = self._get_executor()
+                future = executor.submit(fn, *args)
+                # the slot is held until the hash really ends, even when this request stops
+                # waiting for it, so a timeout cannot let more than max_pending run at once
+                future.add_done_callback(self._release)
+                result, started = future.result(self.timeout)
+            except Exception as e:
+                if future is None:
+                    # never submitted, so no callback will give the slot back
+                    self._release()
+                if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                    # a hashing process died; start a fresh pool on the next call
+                    with self._lock:
+                        if self._executor is executor:
+                            self._executor = None
+                with self._lock:
+                    self.failed += 1
+                raise
+
+        finished = time.time()
+        waited = max(started - queued, 0.0)
+        with self._lock:
+            self.completed += 1
+            self.queue_s += waited
+            self.max_queue_s = max(self.max_queue_s, waited)
+            self.hash_s += max(finished - started, 0.0)
+
+        return result
+
+    def _release(self, future=None):
+        self._slots.release()
+        with self._lock:
+            self.in_flight -= 1
+
+    def _to_bytes(self, password):
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        if self.handle_long_passwords:
+            # the same pre-hash flask_bcrypt uses, so existing hashes still verify
+            password = hashlib.sha256(password).hexdigest().encode('utf-8')
+        return password
+
+    def generate_password_hash(self, password, rounds=None):
+        if not password:
+            raise ValueError('Password must be non-empty.')
+
+        return self._run(_hash, self._to_bytes(password), rounds or self.rounds, self.prefix.encode('utf-8'))
+
+    def check_password_hash(self, pw_hash, password):
+        if isinstance(pw_hash, str):
+            pw_hash = pw_hash.encode('utf-8')
+
+        return self._run(_check, pw_hash, self._to_bytes(password))
+
+    def needs_rehash(self, pw_hash):
+        rounds = get_rounds(pw_hash)
+        return rounds is not None and rounds != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._executor_pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'rounds': self.rounds,
+                'in_flight': self.in_flight,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'queue_s': self.queue_s,
+                'max_queue_s': self.max_queue_s,
+                'hash_s': self.hash_s,
+            }
+
+
+def create_password_hasher(config):
+    # the same settings flask_bcrypt reads, so both produce interchangeable hashes
+    return PasswordHasher(
+        rounds=config.get('BCRYPT_LOG_ROUNDS', 12),
+        prefix=config.get('BCRYPT_HASH_PREFIX', '2b'),
+        handle_long_passwords=config.get('BCRYPT_HANDLE_LONG_PASSWORDS', False),
+        workers=config['BCRYPT_WORKERS'],
+        max_pending=config['BCRYPT_MAX_PENDING'],
+        queue_timeout=config['BCRYPT_QUEUE_TIMEOUT'],
+    )
+
+
+password_hasher = create_password_hasher(app.config)
+atexit.register(password_hasher.shutdown)
+
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(e):
+    # a login burst is turned away early instead of tying up every request worker
+    return "Too many sign-ins at once; please try again shortly.", 503, {'Retry-After': '5'}
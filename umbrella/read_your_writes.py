@@ -0,0 +1,31 @@
+import time
+
+from flask import session
+
+from umbrella import app
+import umbrella.db_interface as db_interface
+
+SESSION_KEY = '_primary_until'
+
+
+@app.before_request
+def pin_recent_writers():
+    # a session that wrote a moment ago reads from the primary, so it never sees a replica
+    # that has not caught up with its own change
+    db_interface.take_write_flag()
+    if db_interface.get_replicas() is None:
+        return
+
+    db_interface.pin_to_primary(session.get(SESSION_KEY, 0) > time.time())
+
+
+@app.after_request
+def remember_writes(response):
+    if db_interface.take_write_flag() and db_interface.get_replicas() is not None:
+        session[SESSION_KEY] = time.time() + app.config['READ_YOUR_WRITES_S']
+    return response
+
+
+@app.teardown_request
+def unpin(exc):
+    db_interface.pin_to_primary(False)
@@ -1,25 +1,48 @@
 import copy
+import hmac
 
-from flask import render_template, url_for, flash, redirect, request, abort
-from umbrella import app, bcrypt
+from flask import render_template, stream_template, url_for, flash, redirect, request, abort
+from umbrella import app
 from umbrella.forms import RegistrationForm, LoginForm, UpdateProfileForm, PostForm, CommentForm
 import umbrella.models as models
 import umbrella.db_interface as db_interface
+from umbrella.view_counter import post_views, MAX_ID
+from umbrella.page_cache import page_cache
+from umbrella.conditional import conditional
+from umbrella.metrics import render_metrics
+from umbrella.password_hasher import password_hasher, HasherBusy
+from umbrella.taken_values import taken_values
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_paginate import Pagination
+from psycopg2.errors import UniqueViolation
+
+
+def render_feed():
+    category_id = request.args.get('category', default=None, type=int)
+    cursor = request.args.get('cursor', default=None)
+
+    try:
+        posts, next_cursor = models.Post().query_feed(category_id, cursor, limit=20)
+    except ValueError:
+        abort(400)
+
+    return render_template('_post_list.html', posts=posts,
+                           next_cursor=next_cursor, category=category_id)
 
 
 @app.route("/")
 @app.route("/home")
+@conditional('home', lambda: models.get_feed_version())
 def home():
     cats = models.Category().query_categories()
-    category_id = request.args.get('category', default=None)
-    if category_id:
-        posts = models.Post().query_posts(limit=20, post_filter=('category_id', category_id))
-        return render_template('home.html', posts=posts, cats=cats)
+    feed = page_cache.fragment('feed', render_feed)
+
+    return render_template('home.html', feed=feed, cats=cats)
 
-    posts = models.Post().query_posts(limit=20)
-    return render_template('home.html', posts=posts, cats=cats)
+
+@app.route("/home/more")
+def home_more():
+    return page_cache.fragment('feed', render_feed)
 
 
 @app.route("/register", methods=['GET', 'POST'])
@@ -27,21 +50,37 @@ def register():
     form = RegistrationForm()
 
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data)
-        hashed_password_str = hashed_password.decode('utf-8')
+        hashed_password_str = password_hasher.generate_password_hash(form.password.data)
 
         if not form.bio:
             user = models.User(form.username.data, hashed_password_str, form.email.data)
         else:
             user = models.User(form.username.data, hashed_password_str, form.email.data, form.bio.data)
 
-        db_interface.insert_table('profile', user)
+        try:
+            with db_interface.transaction(batch=True):
+                db_interface.insert_table('profile', user)
+        except UniqueViolation as e:
+            if not form.add_violation(e):
+                raise
+            return render_template('register.html', title='Register', form=form)
+
+        taken_values.add('profile', {'username': form.username.data, 'email': form.email.data})
         flash(f'"{form.username.data}" account has been created.')
         return redirect(url_for('login'))
 
     return render_template('register.html', title='Register', form=form)
 
 
+def rehash_password(user, password):
+    # the cost changed since this hash was made; the plain password is only on hand at login
+    try:
+        user.update_password(password_hasher.generate_password_hash(password))
+    except HasherBusy:
+        # try again next time rather than turn away a correct password
+        pass
+
+
 @app.route("/login", methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -50,7 +89,9 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         users = models.User().query_users(('email', form.email.data))
-        if len(users) != 0 and bcrypt.check_password_hash(users[0].password, form.password.data):
+        if len(users) != 0 and password_hasher.check_password_hash(users[0].password, form.password.data):
+            if password_hasher.needs_rehash(users[0].password):
+                rehash_password(users[0], form.password.data)
             login_user(users[0], remember=form.remember.data)
             flash('You are now logged in.')
             return redirect(url_for('home'))
@@ -67,6 +108,7 @@ def logout():
 
 
 @app.route("/profile/<int:profile_id>")
+@conditional('profile', lambda profile_id: models.get_profile_version(profile_id))
 def profile(profile_id):
     profiles = models.User().query_users(('id', profile_id))
     if len(profiles) == 0:
@@ -75,6 +117,17 @@ def profile(profile_id):
     return render_template('profile.html', title='Profile', profile=profile)
 
 
+@app.route("/profile/<int:profile_id>/posts")
+def profile_posts(profile_id):
+    profiles = models.User().query_users(('id', profile_id))
+    if len(profiles) == 0:
+        abort(404)
+
+    # every post of the user, however many: rows are fetched and rendered a chunk at a time
+    posts = models.Post().stream_posts(('author_id', profile_id), columns=models.Post.listing_columns)
+    return stream_template('profile_posts.html', title='Posts', profile=profiles[0], posts=posts)
+
+
 @app.route("/profile/update", methods=['GET', 'POST'])
 @login_required
 def update_profile():
@@ -92,7 +145,18 @@ def update_profile():
             user.username = form.username.data
             user.email = form.email.data
 
-        db_interface.update_row_obj(user, 'profile', ('id', current_user.id))
+        try:
+            db_interface.update_row_obj(user, 'profile', ('id', current_user.id))
+        except UniqueViolation as e:
+            if not form.add_violation(e):
+                raise
+            return render_template('update_profile.html', title='Profile', form=form)
+
+        models.user_cache.pop(current_user.id)
+        taken_values.add('profile', {'username': form.username.data, 'email': form.email.data})
+
+        # usernames show up in every feed and post fragment
+        page_cache.clear()
         flash('Profile has been updated.')
         return redirect(url_for('profile', profile_id=current_user.id))
 
@@ -112,16 +176,24 @@ def create_post():
         post = models.Post(form.title.data, form.content.data, 0, current_user.id)
         post.author_id = current_user.id
 
-        # can only be one element since titles have unique constraint
-        cat = models.Category().query_categories(('title', form.category.data))[0]
-        post.category_id = cat.id
+        # the insert and the category count change commit together, in one batch
+        try:
+            with db_interface.transaction(batch=True):
+                # can only be one element since titles have unique constraint
+                cat = models.Category().query_categories(('title', form.category.data))[0]
+                post.category_id = cat.id
 
-        db_interface.insert_table(post.table_name, post)
+                db_interface.insert_table(post.table_name, post)
 
-        # get category of post and increment the categories' post_count
-        db_interface.update_row(['post_count'], [], cat.table_name, ('id', cat.id),
-                                default_col='post_count')
+                # get category of post and increment the categories' post_count
+                db_interface.increment_counts(cat.table_name, 'post_count', {cat.id: 1})
+        except UniqueViolation as e:
+            if not form.add_violation(e):
+                raise
+            return render_template('create_post.html', title='New Post', form=form)
 
+        taken_values.add('post', {'title': form.title.data})
+        page_cache.invalidate('feed')
         flash('Post has been created.')
         return redirect(url_for('home'))
 
@@ -129,23 +201,38 @@ def create_post():
 
 
 @app.route("/post/<int:post_id>", methods=['GET', 'POST'])
+@conditional('post', lambda post_id: models.get_post_version(post_id), csrf_bound=True)
 def post(post_id):
     form = CommentForm()
-    post_comment = models.PostComment(post_id)
 
     if form.validate_on_submit():
         if current_user.is_authenticated:
             com = models.Comment(form.content.data, current_user, post_id)
             com.author_id = current_user.id
-            db_interface.insert_table('comment', com)
+            with db_interface.transaction(batch=True):
+                db_interface.insert_table('comment', com)
+            page_cache.invalidate(f'post:{post_id}')
             flash('Comment has been posted.')
             return redirect(url_for('post', post_id=post_id))
 
         flash('You must be logged in to comment.')
         return redirect(url_for('post', post_id=post_id))
 
-    return render_template('post.html', title=post_comment.post.title,
-                           post_comment=post_comment, form=form)
+    # the page data is only needed when rendering, not when a comment is posted
+    page = page_cache.fragment(f'post:{post_id}', lambda: render_post_page(post_id))
+
+    return render_template('post.html', title=page['title'], page=page, form=form)
+
+
+def render_post_page(post_id):
+    post_comment = models.PostComment.load(post_id)
+
+    return {
+        'title': post_comment.post.title,
+        'article': render_template('_post_article.html', post_comment=post_comment),
+        'comments': render_template('_post_comments.html', post_comment=post_comment),
+        'footer': render_template('_post_footer.html', post_comment=post_comment),
+    }
 
 
 def read_or_abort_p(filter, use_like=False):
@@ -174,7 +261,15 @@ def update_post(post_id):
         new_post.title = form.title.data
         new_post.content = form.content.data
 
-        db_interface.update_row_obj(new_post, post.table_name, ('id', post.id))
+        try:
+            db_interface.update_row_obj(new_post, post.table_name, ('id', post.id))
+        except UniqueViolation as e:
+            if not form.add_violation(e):
+                raise
+            return render_template('create_post.html', title='Update Post', form=form)
+
+        taken_values.add('post', {'title': form.title.data})
+        page_cache.invalidate('feed', f'post:{post.id}')
         flash('Post has been updated.')
         return redirect(url_for('post', post_id=post.id))
     elif request.method == 'GET':
@@ -193,29 +288,53 @@ def delete_post(post_id):
         abort(403)
 
     db_interface.soft_delete('post', ('id', post_id))
+    page_cache.invalidate('feed', f'post:{post_id}')
     flash('Post has been deleted.')
     return redirect(url_for('home'))
 
 
 @app.route("/post/<int:post_id>/view")
 def increment_post_view_count(post_id):
-    db_interface.update_row(['view_count'], [], 'post', ('id', post_id),
-                            default_col='view_count')
+    # no such post; the route's int converter takes numbers of any size
+    if post_id > MAX_ID:
+        abort(404)
+
+    # buffered in memory and written in batches by the view counter
+    post_views.add(post_id)
 
     return "View count incremented"
 
 
+def get_search_version():
+    if not request.args.get('query'):
+        return None
+    return models.get_feed_version()
+
+
 @app.route("/search-results")
+@conditional('search', get_search_version)
 def search():
     search_query = request.args.get('query', default=None)
     if not (search_query):
         abort(400)
-    page = request.args.get('page', default=1, type=int)
-
-    posts = models.Post().query_posts(('title', search_query), use_like=True)
+    page = max(request.args.get('page', default=1, type=int), 1)
+    per_page = 10
 
-    pagination = Pagination(page=page, per_page=10, total=len(posts))
+    # counting stops at the cap so a very common term costs the same as a rare one
+    posts, total = models.Post().search_page(search_query, limit=per_page, offset=(page - 1) * per_page,
+                                             max_count=app.config['SEARCH_MAX_COUNT'])
+    pagination = Pagination(page=page, per_page=per_page, total=total)
 
     return render_template('search.html',
                            title=search_query + ' Search Results',
                            posts=posts, pagination=pagination, query=search_query)
+
+
+@app.route("/metrics")
+def metrics():
+    # closed until a token is configured; the SQL fingerprints describe the schema
+    token = app.config['METRICS_TOKEN']
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(403)
+
+    return app.response_class(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,116 @@
+import umbrella.db_interface as db_interface
+import umbrella.models as models
+from umbrella.category_directory import install_notify_trigger
+
+
+TOUCH_FUNCTION_DDL = """
+CREATE OR REPLACE FUNCTION umbrella_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def get_touch_columns(model):
+    # every column an UPDATE can set, except the counters and updated_at itself;
+    # None when the model has no counters, so any UPDATE touches
+    if not model.counter_columns:
+        return None
+
+    skipped = set(model.counter_columns) | {'updated_at'}
+    return [col[0] for col in model.db_columns
+            if col[0].strip('"') not in skipped and not any('GENERATED' in part for part in col[2:])]
+
+
+def install_touch_trigger(table_name, columns=None):
+    # keeps updated_at current on every UPDATE, whichever code path issues it;
+    # with columns, only on an UPDATE that sets one of them
+    update_of = "UPDATE OF " + ", ".join(columns) if columns else "UPDATE"
+
+    db_interface.run_query(TOUCH_FUNCTION_DDL)
+    db_interface.run_query(
+        f"""
+        DROP TRIGGER IF EXISTS {table_name}_touch_updated_at ON {table_name};
+        CREATE TRIGGER {table_name}_touch_updated_at
+            BEFORE {update_of} ON {table_name}
+            FOR EACH ROW EXECUTE FUNCTION umbrella_touch_updated_at();
+        """
+    )
+
+
+def sync_schema(concurrently=True, dry_run=False):
+    # creates missing tables, columns and declared indexes; never drops anything
+    report = {'tables': [], 'columns': [], 'indexes': [], 'triggers': []}
+    db_models = models.db_models()
+
+    for m in db_models:
+        if not db_interface.does_table_exist(m.table_name):
+            report['tables'].append(m.table_name)
+            if not dry_run:
+                db_interface.create_table(m.table_name, m.db_columns)
+
+    if not dry_run:
+        db_interface.invalidate_table_columns()
+
+    for table_name, (missing, _) in models.check_model_columns().items():
+        if table_name in report['tables']:
+            continue
+
+        m = next(m for m in db_models if m.table_name == table_name)
+        for col in m.db_columns:
+            if col[0].strip('"') in missing:
+                report['columns'].append(f"{table_name}.{col[0]}")
+                if not dry_run:
+                    db_interface.add_column(table_name, col)
+
+    existing = {row[1] for row in db_interface.get_index_stats([m.table_name for m in db_models])}
+    for m in db_models:
+        for index in m.db_indexes:
+            if index[0] not in existing:
+                report['indexes'].append(index[0])
+                if not dry_run:
+                    db_interface.create_index(m.table_name, index, concurrently=concurrently)
+
+    # replaced on every run, so they always match the code
+    for m in db_models:
+        if any(col[0] == 'updated_at' for col in m.db_columns):
+            report['triggers'].append(f'{m.table_name}_touch_updated_at')
+            if not dry_run:
+                install_touch_trigger(m.table_name, get_touch_columns(m))
+
+    report['triggers'].append('category_changed_notify')
+    if not dry_run:
+        install_notify_trigger()
+
+    return report
+
+
+def index_report():
+    # compares the declared indexes with what pg_stat_user_indexes has seen since the last stats reset
+    db_models = models.db_models()
+    declared = {index[0]: m.table_name for m in db_models for index in m.db_indexes}
+
+    report = {'missing': [], 'invalid': [], 'unused': [], 'undeclared': []}
+    seen = set()
+
+    for table_name, index_name, scans, size, is_valid, is_constraint in \
+            db_interface.get_index_stats([m.table_name for m in db_models]):
+        seen.add(index_name)
+
+        if not is_valid:
+            # left behind by a failed CREATE INDEX CONCURRENTLY; drop it and sync again
+            report['invalid'].append((table_name, index_name))
+        if is_constraint:
+            continue
+        if scans == 0:
+            report['unused'].append((table_name, index_name, size))
+        if index_name not in declared:
+            report['undeclared'].append((table_name, index_name))
+
+    for index_name, table_name in declared.items():
+        if index_name not in seen:
+            report['missing'].append((table_name, index_name))
+
+    return report
@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+
+from umbrella import app
+from umbrella.cache import BloomFilter
+import umbrella.db_interface as db_interface
+
+logger = logging.getLogger(__name__)
+
+
+class TakenValues():
+    def __init__(self, columns: dict, enabled=True, max_age=300.0, error_rate=0.01):
+        # columns maps a table to its unique columns; with enabled, each column gets a Bloom
+        # filter of the values in use, so a value never taken is known free without a query
+        self.columns = columns
+        self.enabled = enabled
+        self.error_rate = error_rate
+
+        # rebuilt after this many seconds, to pick up values other processes inserted
+        self.max_age = max_age
+
+        # (table, column) -> (filter, built at)
+        self._filters = {}
+        # (table, column) -> (pid of the building process, values added while it builds)
+        self._building = {}
+        # (table, column) -> when a failed build may be tried again
+        self._retry_at = {}
+        self._lock = threading.Lock()
+
+        self.probes = 0
+        self.skipped = 0
+        self.taken = 0
+        self.rebuilds = 0
+        self.failed_rebuilds = 0
+
+    def build(self, table_name, column):
+        # sized from the planner's row estimate, so building it never needs a count(*)
+        estimate = db_interface.run_query("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                                          [table_name])[0][0]
+        bloom = BloomFilter(max(estimate, 0) * 2 + 1024, self.error_rate)
+
+        for rows in db_interface.stream_query(f"SELECT {column} FROM {table_name}", batch_size=5000):
+            for (value,) in rows:
+                bloom.add(value)
+
+        return bloom
+
+    def _get_filter(self, table_name, column):
+        # None, and a plain probe, until a fresh filter is ready; it is built in the background,
+        # since a full scan of the column has no place inside a request
+        entry = self._filters.get((table_name, column))
+        if entry is not None and time.monotonic() - entry[1] < self.max_age:
+            return entry[0]
+
+        key = (table_name, column)
+        with self._lock:
+            building = self._building.get(key)
+            # a build started before a fork has no thread in this process
+            if (building is None or building[0] != os.getpid()) and \
+                    time.monotonic() >= self._retry_at.get(key, 0):
+                self._building[key] = (os.getpid(), [])
+                threading.Thread(target=self._rebuild, args=key, name='umbrella-taken-values',
+                                 daemon=True).start()
+
+        return None
+
+    def _rebuild(self, table_name, column):
+        key = (table_name, column)
+        try:
+            bloom = self.build(table_name, column)
+        except Exception:
+            with self._lock:
+                self._building.pop(key, None)
+                self._retry_at[key] = time.monotonic() + min(self.max_age, 30.0)
+                self.failed_rebuilds += 1
+            logger.exception("Building the %s.%s filter failed.", table_name, column)
+            return
+
+        with self._lock:
+            # values written while the scan ran may have been missed by it
+            _, added = self._building.pop(key, (None, []))
+            for value in added:
+                bloom.add(value)
+            self._filters[key] = (bloom, time.monotonic())
+            self.rebuilds += 1
+
+    def find_taken(self, table_name, values: dict):
+        # the columns of values already in use; at most one round trip for all of them
+        maybe = {}
+        for column, value in values.items():
+            bloom = self._get_filter(table_name, column) if self.enabled else None
+            if bloom is not None and value not in bloom:
+                self.skipped += 1
+                continue
+            maybe[column] = value
+
+        if not maybe:
+            return set()
+
+        taken = db_interface.find_existing(table_name, maybe)
+        self.probes += 1
+        self.taken += len(taken)
+        return taken
+
+    def add(self, table_name, values: dict):
+        # called after a write succeeds, so this process sees its own values straight away
+        with self._lock:
+            for column, value in values.items():
+                entry = self._filters.get((table_name, column))
+                if entry is not None:
+                    entry[0].add(value)
+
+                building = self._building.get((table_name, column))
+                if building is not None:
+                    building[1].append(value)
+
+    def stats(self):
+        return {
+            'filters': len(self._filters),
+            'probes': self.probes,
+            'skipped': self.skipped,
+            'taken': self.taken,
+            'rebuilds': self.rebuilds,
+            'failed_rebuilds': self.failed_rebuilds,
+        }
+
+
+taken_values = TakenValues(
+    {'profile': ['username', 'email'], 'post': ['title']},
+    enabled=app.config['UNIQUE_BLOOM'],
+    max_age=app.config['UNIQUE_BLOOM_MAX_AGE'],
+)
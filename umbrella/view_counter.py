@@ -0,0 +1,138 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+import umbrella.db_interface as db_interface
+
+logger = logging.getLogger(__name__)
+
+# ids are int4 columns; a bigger one would make the whole batch's UPDATE fail
+MAX_ID = 2 ** 31 - 1
+
+
+class ViewCounter():
+    def __init__(self, flush, interval=1.0, max_hits=500, max_retries=30):
+        # flush is called with {id: delta} and must write every delta in one go
+        self._flush = flush
+        self.interval = interval
+        self.max_hits = max_hits
+
+        # a batch that failed this many flushes in a row is dropped, so one bad batch
+        # cannot stop every later count from being written
+        self.max_retries = max_retries
+        self._retries = 0
+
+        self._pending = {}
+        self._hits = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+        self.flushes = 0
+        self.flushed_hits = 0
+        self.failed_flushes = 0
+        self.dropped_hits = 0
+        self.last_flush_lag = 0.0
+
+    def add(self, id, count=1):
+        if not 0 < id <= MAX_ID:
+            raise ValueError(f"Not a valid id: {id}.")
+
+        with self._lock:
+            self._pending[id] = self._pending.get(id, 0) + count
+            self._hits += count
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = self._hits >= self.max_hits
+
+        self._start()
+        if full:
+            self._wake.set()
+
+    def _start(self):
+        if self._thread is not None or self._stopped:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='umbrella-view-counter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, hits, oldest = self._pending, self._hits, self._oldest
+                self._pending, self._hits, self._oldest = {}, 0, None
+
+            if not pending:
+                return
+
+            try:
+                self._flush(pending)
+            except Exception:
+                self.failed_flushes += 1
+                self._retries += 1
+                if self._retries > self.max_retries:
+                    self._retries = 0
+                    self.dropped_hits += hits
+                    logger.exception("Flushing %d buffered views failed %d times; dropping them.",
+                                     hits, self.max_retries + 1)
+                    return
+
+                # keep the hits for the next attempt rather than losing them
+                with self._lock:
+                    for id, delta in pending.items():
+                        self._pending[id] = self._pending.get(id, 0) + delta
+                    self._hits += hits
+                    self._oldest = min(oldest, self._oldest or oldest)
+                logger.exception("Flushing %d buffered views failed.", hits)
+                return
+
+            self._retries = 0
+            self.flushes += 1
+            self.flushed_hits += hits
+            self.last_flush_lag = time.monotonic() - oldest
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            lag = time.monotonic() - self._oldest if self._oldest is not None else 0.0
+            return {
+                'buffered_ids': len(self._pending),
+                'buffered_hits': self._hits,
+                'lag_s': lag,
+                'last_flush_lag_s': self.last_flush_lag,
+                'flushes': self.flushes,
+                'flushed_hits': self.flushed_hits,
+                'failed_flushes': self.failed_flushes,
+                'dropped_hits': self.dropped_hits,
+            }
+
+
+def flush_post_views(deltas):
+    db_interface.increment_counts('post', 'view_count', deltas)
+
+
+post_views = ViewCounter(
+    flush_post_views,
+    interval=float(os.getenv('UMBRELLA_VIEW_FLUSH_INTERVAL', 1.0)),
+    max_hits=int(os.getenv('UMBRELLA_VIEW_FLUSH_HITS', 500)),
+)
+atexit.register(post_views.stop)